@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# vim:ts=4:sts=4:sw=4:tw=80:et
+
+"""Benchmark the timetrack actions against synthetic multi-year histories.
+
+Every history is generated into a temporary database, then each action handler
+is timed on it while counting the SQL statements it executes and tracking its
+peak memory. The results can be written as JSON and compared against a stored
+baseline, failing if an action got slower or issues more statements."""
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import date, datetime, time, timedelta
+from time import perf_counter
+
+import timetrack
+
+# Probability of a sick day on any workday, and number of vacation days per year
+SICK_DAY_CHANCE = 0.03
+VACATION_DAYS = 25
+# Probability of having to work on a Saturday
+SATURDAY_CHANCE = 0.02
+# Seconds a punch run from a hook should take, start of the interpreter included
+STARTUP_TARGET = 0.030
+
+
+def generateDay(rng, day):
+    """Generate the entries of a single work day."""
+    ts = datetime.combine(day, time(7)) + timedelta(seconds=rng.randint(0, 3 * 3600))
+    entries = [(timetrack.ACT_ARRIVE, ts)]
+    workLeft = timedelta(hours=timetrack.DAY_HOURS) + timedelta(minutes=rng.randint(-60, 90))
+    for _ in range(rng.choice([0, 1, 1, 2, 2, 3])):
+        worked = timedelta(seconds=rng.randint(3600, 4 * 3600))
+        if worked >= workLeft:
+            break
+        ts += worked
+        workLeft -= worked
+        entries.append((timetrack.ACT_BREAK, ts))
+        ts += timedelta(seconds=rng.randint(5 * 60, 60 * 60))
+        entries.append((timetrack.ACT_RESUME, ts))
+    entries.append((timetrack.ACT_LEAVE, ts + workLeft))
+    return entries
+
+
+def generateHistory(rng, start, end):
+    """Generate the entries of one person from start until the day before end, with
+    weekends, vacations, sick days and the occasional missing day."""
+    vacation = set()
+    for year in range(start.year, end.year + 1):
+        # a few blocks of vacation per year
+        daysLeft = VACATION_DAYS
+        while daysLeft > 0:
+            length = min(daysLeft, rng.choice([3, 5, 10]))
+            first = date(year, 1, 1) + timedelta(days=rng.randint(0, 364 - length))
+            vacation.update(first + timedelta(days=i) for i in range(length))
+            daysLeft -= length
+    day = start
+    while day < end:
+        if day.weekday() < 5:
+            working = day not in vacation and rng.random() >= SICK_DAY_CHANCE
+        else:
+            working = day.weekday() == 5 and rng.random() < SATURDAY_CHANCE
+        if working:
+            yield from generateDay(rng, day)
+        day += timedelta(days=1)
+
+
+def createDatabase(path, years, users, seed):
+    """Create a database at path with the given number of years of history for each
+    user, ending yesterday. Returns the user names and the number of entries."""
+    rng = random.Random(seed)
+    con = timetrack.dbSetup(path=path)
+    end = date.today()
+    start = end - timedelta(days=round(365.25 * years))
+    names = [f"user{i:d}" for i in range(users)]
+    con.execute("BEGIN IMMEDIATE")
+    for user in names:
+        con.executemany(
+            "INSERT INTO times (user, project, type, ts) VALUES (?, '', ?, ?)",
+            ((user, type, con.adaptTs(ts)) for type, ts in generateHistory(rng, start, end)),
+        )
+    con.execute(
+        """
+            INSERT INTO state (user, project, type, ts)
+            SELECT user, project, type, MAX(ts) FROM times GROUP BY user, project
+        """
+    )
+    timetrack.rebuildDailySummary(con)
+    con.commit()
+    rows = con.execute("SELECT COUNT(*) FROM times").fetchone()[0]
+    con.close()
+    return names, rows
+
+
+# Benchmarked actions: name, handler and keyword arguments. Punches run in this
+# order, so each of them is a valid transition.
+ACTIONS = [
+    ("morning", timetrack.startTracking, {}),
+    ("break", timetrack.suspendTracking, {}),
+    ("resume", timetrack.resumeTracking, {}),
+    ("day", timetrack.dayStatistics, {}),
+    ("week", timetrack.weekStatistics, {}),
+    ("week -1", timetrack.weekStatistics, {"offset": -1}),
+    ("month", timetrack.monthStatistics, {}),
+    ("month -1", timetrack.monthStatistics, {"offset": -1}),
+    ("summary", timetrack.overallStatistics, {"weeks": None}),
+    ("balance", timetrack.balanceStatistics, {}),
+    ("closing", timetrack.endTracking, {}),
+]
+
+
+def runAction(con, handler, kwargs, traceMemory=False):
+    """Run a single action handler, returning its wall time in seconds, the number of
+    SQL statements it executed and, if traceMemory is set, its peak memory use in
+    bytes. Tracing memory slows everything down, so don't trust the time then."""
+    statements = 0
+
+    def countStatement(_):
+        nonlocal statements
+        statements += 1
+
+    con.set_trace_callback(countStatement)
+    if traceMemory:
+        tracemalloc.start()
+    try:
+        with redirect_stdout(io.StringIO()):
+            start = perf_counter()
+            handler(con, **kwargs)
+            duration = perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if traceMemory else 0
+    finally:
+        tracemalloc.stop()
+        con.set_trace_callback(None)
+    return duration, statements, peak
+
+
+def benchmark(years, users, repeat, seed):
+    """Benchmark all actions on a fresh history. Returns a dict of results by name."""
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "timetrack.db")
+        start = perf_counter()
+        names, rows = createDatabase(path, years, users, seed)
+        print(f"{years:>2d} years, {users:d} users: generated {rows} entries in {perf_counter() - start:.2f} s")
+        con = timetrack.dbSetup(path=path, user=names[0])
+        # one more round than requested, the last one only measures the memory
+        for iteration in range(repeat + 1):
+            for name, handler, kwargs in ACTIONS:
+                duration, statements, peak = runAction(con, handler, kwargs, traceMemory=iteration == repeat)
+                result = results.setdefault(
+                    f"{years}y/{name}", {"seconds": duration, "statements": statements, "peak_kib": 0}
+                )
+                if iteration < repeat:
+                    # the fastest run is the least disturbed one
+                    result["seconds"] = min(result["seconds"], duration)
+                result["statements"] = max(result["statements"], statements)
+                result["peak_kib"] = max(result["peak_kib"], peak // 1024)
+        con.close()
+    for name, result in results.items():
+        print(
+            f"  {name:<16s} {result['seconds'] * 1000:>9.2f} ms"
+            f" {result['statements']:>6d} statements {result['peak_kib']:>8d} KiB"
+        )
+    return results
+
+
+# Commands whose start is timed in a fresh process: name and arguments of the
+# interpreter. The bare interpreter and the sqlite3 module are what no punch can
+# get below. A script run directly is compiled on every start, a module is not.
+STARTUP_COMMANDS = [
+    ("python", ["-c", "pass"]),
+    ("import sqlite3", ["-c", "import sqlite3"]),
+    ("punch", ["-m", "timetrack"]),
+    ("punch script", [timetrack.__file__]),
+    ("status", ["-m", "timetrack", "status"]),
+]
+# Punches cycled through, so each of them is a valid transition
+STARTUP_PUNCHES = ["morning", "break", "resume", "closing"]
+
+
+def benchmarkStartup(repeat):
+    """Time the start of fresh processes on an empty database, with no daemon to
+    forward to. Returns a dict of results by name, like benchmark()."""
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        environ = {
+            **{key: value for key, value in os.environ.items() if key != "PYTHONDONTWRITEBYTECODE"},
+            "PYTHONPATH": os.path.dirname(os.path.abspath(timetrack.__file__)),
+            "PYTHONPYCACHEPREFIX": os.path.join(directory, "pycache"),
+            "TIMETRACK_DB": os.path.join(directory, "timetrack.db"),
+            "TIMETRACK_SOCKET": os.path.join(directory, "timetrack.sock"),
+        }
+        # compile the module once, as any installation would have, but not into the tree
+        subprocess.run([sys.executable, "-c", "import timetrack"], env=environ, check=True)
+        for name, arguments in STARTUP_COMMANDS:
+            seconds = None
+            for iteration in range(repeat * len(STARTUP_PUNCHES)):
+                command = [sys.executable, *arguments]
+                if name.startswith("punch"):
+                    command.append(STARTUP_PUNCHES[iteration % len(STARTUP_PUNCHES)])
+                start = perf_counter()
+                subprocess.run(command, env=environ, check=True, stdout=subprocess.DEVNULL)
+                duration = perf_counter() - start
+                # the fastest run is the least disturbed one
+                seconds = duration if seconds is None else min(seconds, duration)
+            results[f"startup/{name}"] = {"seconds": seconds, "statements": 0, "peak_kib": 0}
+    print(f"Startup in fresh processes, target {STARTUP_TARGET * 1000:.0f} ms per punch:")
+    for name, result in results.items():
+        print(f"  {name:<22s} {result['seconds'] * 1000:>9.2f} ms")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Compare results against a baseline. Returns a list of regressions."""
+    regressions = []
+    for name, old in sorted(baseline["results"].items()):
+        new = results.get(name)
+        if new is None:
+            continue
+        if new["seconds"] > old["seconds"] * (1 + tolerance):
+            regressions.append(f"{name}: {old['seconds'] * 1000:.2f} ms -> {new['seconds'] * 1000:.2f} ms")
+        if new["statements"] > old["statements"]:
+            regressions.append(f"{name}: {old['statements']} -> {new['statements']} statements")
+        if new["peak_kib"] > old["peak_kib"] * (1 + tolerance) + 64:
+            regressions.append(f"{name}: {old['peak_kib']} KiB -> {new['peak_kib']} KiB peak memory")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark timetrack against synthetic histories")
+    parser.add_argument(
+        "--years", type=int, nargs="+", default=[1, 5, 20], help="Lengths of the histories to generate, in years"
+    )
+    parser.add_argument("--users", type=int, default=3, help="Number of users in every history")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of times to run every action")
+    parser.add_argument("--seed", type=int, default=42, help="Seed of the history generator")
+    parser.add_argument("--output", help="File to write the results to as JSON")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.25, help="Relative slowdown accepted before failing (default: 0.25)"
+    )
+    parser.add_argument("--no-startup", action="store_true", help="Don't time the start of fresh processes")
+    args = parser.parse_args()
+
+    results = {} if args.no_startup else benchmarkStartup(args.repeat)
+    for years in args.years:
+        results.update(benchmark(years, args.users, args.repeat, args.seed))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "sqlite": sqlite3.sqlite_version,
+                    "results": results,
+                },
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions against {}:".format(args.baseline), file=sys.stderr)
+            for regression in regressions:
+                print(f"  {regression}", file=sys.stderr)
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+import asyncio
+import os
+from datetime import date, datetime, time, timedelta, timezone
+
+import pytest
+
+import timetrack
+
+
+def upgradeTo(path, target):
+    """Create a database at path with the schema upgrades up to version target only."""
+    con = timetrack.dbSetup(upgrade=False, path=path)
+    for version, _ in timetrack.dbUpgrade(con):
+        if version == target:
+            break
+    return con
+
+
+def test_upgrade_keeps_epoch_timestamps(tmp_path):
+    # a version 5 database whose timestamps were converted to epoch microseconds
+    path = str(tmp_path / "timetrack.db")
+    con = upgradeTo(path, 5)
+    day = date.today() - timedelta(days=3)
+    entries = [
+        (timetrack.ACT_ARRIVE, time(8)),
+        (timetrack.ACT_BREAK, time(12)),
+        (timetrack.ACT_RESUME, time(12, 30)),
+        (timetrack.ACT_LEAVE, time(17)),
+    ]
+    con.executemany(
+        "INSERT INTO times (type, ts) VALUES (?, ?)",
+        ((type, timetrack.adapt_datetime_epoch(datetime.combine(day, ts))) for type, ts in entries),
+    )
+    con.execute("UPDATE settings SET value = ? WHERE key = 'timestamps'", (timetrack.TS_EPOCH,))
+    con.commit()
+    con.close()
+
+    con = timetrack.dbSetup(path=path)
+    assert con.timestamps == timetrack.TS_EPOCH
+    assert [tuple(row) for row in con.execute("SELECT day, work FROM daily_summary")] == [(day, 8 * 60 + 30)]
+    assert timetrack.computeBalance(con, day, day).total == timedelta(hours=8, minutes=30)
+    con.close()
+
+
+def test_profile_flags():
+    assert timetrack.profileRows("no") == timetrack.profileRows("0") == 0
+    assert timetrack.profileRows("yes") == timetrack.profileRows("True") == timetrack.profileRows("1") == 20
+    assert timetrack.profileRows("5") == 5
+
+
+def test_malformed_environment_is_left_to_the_parser(monkeypatch, capsys):
+    monkeypatch.setattr(timetrack, "PROFILE", "maybe")
+    assert timetrack.parsePunchArgs(["morning"]) is None
+    with pytest.raises(SystemExit):
+        timetrack.buildParser().parse_args(["day"])
+    assert "invalid profileRows value: 'maybe'" in capsys.readouterr().err
+
+
+def apiRequest(tmp_path, method, target):
+    """Answer a single request of the HTTP api on a database in tmp_path."""
+    path = str(tmp_path / "timetrack.db")
+    timetrack.dbSetup(path=path).close()
+    server = timetrack.ApiServer(path, 5000, "", "", 1)
+    with server.readers, server.writer:
+        return asyncio.run(server.respond(method, target))
+
+
+def test_api_first_punch(tmp_path):
+    status, payload = apiRequest(tmp_path, "POST", "/morning")
+    assert status == 200
+    assert payload["type"] == timetrack.ACT_ARRIVE and payload["previous"] is None
+
+
+@pytest.mark.parametrize("target", ["/day?offset=99999999999", "/week?offset=99999999999", "/morning?offset=-1e9"])
+def test_api_rejects_offsets_out_of_range(tmp_path, target):
+    status, payload = apiRequest(tmp_path, "POST" if target.startswith("/morning") else "GET", target)
+    assert status == 400 and payload["error"]
+
+
+def test_api_answers_unexpected_errors(tmp_path, monkeypatch, capsys):
+    def broken(con, offset):
+        raise RuntimeError("broken")
+
+    monkeypatch.setattr(timetrack, "computeDay", broken)
+    status, payload = apiRequest(tmp_path, "GET", "/day")
+    assert status == 500 and "broken" in payload["error"]
+    assert "RuntimeError" in capsys.readouterr().err
+
+
+def test_message_catalog_gaps_fall_back_to_the_built_in_messages():
+    catalog = timetrack.MessageCatalog(
+        {
+            **timetrack.MESSAGES,
+            "arrival": [{"text": "Good evening.", "hours": [20, 21]}],
+            "not-working": [{"text": "Still on a break.", "previous": [timetrack.ACT_BREAK]}],
+        }
+    )
+    assert catalog.randomMessage("arrival", datetime(2000, 1, 3, 20)) == "Good evening."
+    assert catalog.randomMessage("arrival", datetime(2000, 1, 3, 8)) in [
+        candidate["text"] for candidate in timetrack.MESSAGES["arrival"]
+    ]
+    assert catalog.randomMessage("not-working", previous=None) == timetrack.MESSAGES["not-working"][-1]["text"]
+
+
+def test_import_rejects_implausible_timestamps(tmp_path):
+    path = tmp_path / "entries.csv"
+    path.write_text(
+        "arrive,2024-03-04 08:00:00\n"
+        "break,99999999999999999999999\n"
+        "break,1\n"
+        "break,2024-03-05 12:00:00+01:00\n"
+        "resume,not a time\n"
+        "resume,2024-03-06 08:00:00\n"
+        "leave,2024-03-06 17:00:00\n"
+    )
+    con = timetrack.dbSetup(path=str(tmp_path / "timetrack.db"))
+    timetrack.importEntries(con, str(path))
+    aware = datetime(2024, 3, 5, 12, tzinfo=timezone(timedelta(hours=1)))
+    assert [tuple(row) for row in con.execute("SELECT type, ts FROM times ORDER BY ts")] == [
+        (timetrack.ACT_ARRIVE, datetime(2024, 3, 4, 8)),
+        (timetrack.ACT_BREAK, aware.astimezone().replace(tzinfo=None)),
+        (timetrack.ACT_RESUME, datetime(2024, 3, 6, 8)),
+        (timetrack.ACT_LEAVE, datetime(2024, 3, 6, 17)),
+    ]
+    assert (tmp_path / "entries.csv.rejects").read_text().splitlines() == [
+        "break,99999999999999999999999",
+        "break,1",
+        "resume,not a time",
+    ]
+    con.close()
+
+
+def test_punch_writes_the_status_snapshot_once(tmp_path, monkeypatch):
+    path = str(tmp_path / "timetrack.db")
+    con = timetrack.dbSetup(path=path)
+    timetrack.punch(con, timetrack.ACT_ARRIVE, -60)
+    replaced = []
+    monkeypatch.setattr(timetrack.os, "replace", lambda *args: replaced.append(args) or os.rename(*args))
+    ts, _ = timetrack.punch(con, timetrack.ACT_BREAK)
+    assert len(replaced) == 1
+    type, since, day, worked = timetrack.loadStatus(timetrack.statusPath(path), "", "")
+    assert (type, since, day) == (timetrack.ACT_BREAK, ts, (ts - timedelta(hours=1)).date())
+    assert worked >= timedelta(minutes=59)
+    con.close()
+
+
+def test_status_of_entries_in_the_future():
+    now = datetime(2000, 1, 3, 12)
+    fields = timetrack.statusFields(timetrack.ACT_ARRIVE, now + timedelta(minutes=90), now.date(), timedelta(0), now)
+    assert (fields["duration"], fields["worked"]) == ("0:00", "0:00")
+
+
+def test_reports_leave_open_transactions_open(tmp_path):
+    con = timetrack.dbSetup(path=str(tmp_path / "timetrack.db"))
+    con.execute("BEGIN IMMEDIATE")
+    timetrack.addEntry(con, timetrack.ACT_ARRIVE, datetime.now() - timedelta(days=30), (None, None))
+    con.execute("BEGIN IMMEDIATE")
+    con.execute(
+        "INSERT INTO times (user, project, type, ts) VALUES ('', '', ?, ?)",
+        (timetrack.ACT_LEAVE, con.adaptTs(datetime.now() - timedelta(days=29))),
+    )
+    timetrack.computeSummary(con, weeks=10)
+    timetrack.computePeriod(con, timetrack.Period.of("year", 0))
+    assert con.in_transaction
+    con.rollback()
+    assert [row["type"] for row in con.execute("SELECT type FROM times")] == [timetrack.ACT_ARRIVE]
+    con.close()
+
+
+def test_days_without_arrival_or_with_broken_entries(tmp_path):
+    day = date(2000, 1, 3)
+    con = timetrack.dbSetup(path=str(tmp_path / "timetrack.db"))
+    record = timetrack.getDay(con, day)
+    assert not record.hasData and record.workTime is None
+    assert record.values() == ("2000-01-03", None, None, None, None, False)
+    con.close()
+
+    record = timetrack.summarizeEntries(
+        day, [(timetrack.ACT_ARRIVE, datetime(2000, 1, 3, 8)), (timetrack.ACT_RESUME, datetime(2000, 1, 3, 9))]
+    )
+    assert not record.hasData and record.arrivedAt == datetime(2000, 1, 3, 8) and "resume" in record.problem
+
+    record = timetrack.summarizeEntries(
+        day,
+        [
+            (timetrack.ACT_ARRIVE, datetime(2000, 1, 3, 8)),
+            (timetrack.ACT_BREAK, datetime(2000, 1, 3, 12)),
+            (timetrack.ACT_RESUME, datetime(2000, 1, 3, 12, 30)),
+            (timetrack.ACT_LEAVE, datetime(2000, 1, 3, 17)),
+        ],
+    )
+    assert record.hasData and not record.currentlyHere
+    assert (record.workTime, record.breakTime) == (timedelta(hours=8, minutes=30), timedelta(minutes=30))
+
+
+def daemonRequest(path, *argv, environ=None):
+    """Return a request to the daemon as sent by forwardToDaemon()."""
+    environ = timetrack.timetrackEnviron() if environ is None else environ
+    return {"argv": ["--db", path, *argv], "cwd": os.getcwd(), "environ": environ}
+
+
+def test_daemon_runs_actions_or_leaves_them_to_the_client(tmp_path):
+    path = str(tmp_path / "timetrack.db")
+    con = timetrack.dbSetup(path=path)
+    daemon = timetrack.Daemon(con, None)
+    reply = daemon.answer(daemonRequest(path, "morning"))
+    assert reply["status"] == 0 and reply["stdout"] and not reply["stderr"]
+    assert timetrack.getState(con)[0] == timetrack.ACT_ARRIVE
+    # aborted actions tell why, and leave nothing behind
+    reply = daemon.answer(daemonRequest(path, "morning"))
+    assert reply["status"] == 1 and reply["stderr"] and not con.in_transaction
+    assert daemon.answer(daemonRequest(path, "--bogus"))["status"] == 2
+    for request in [
+        daemonRequest(path, "break", environ={"TIMETRACK_DB": path}),
+        daemonRequest(str(tmp_path / "other.db"), "break"),
+        daemonRequest(path, "day", "--watch"),
+        daemonRequest(path, "--trace-sql", "break"),
+        daemonRequest(path, "import", str(tmp_path / "entries.csv")),
+    ]:
+        assert daemon.answer(request) == {"fallback": True}
+    assert con.execute("SELECT COUNT(*) FROM times").fetchone()[0] == 1
+    con.close()
+
+
+def test_forward_to_daemon(tmp_path, monkeypatch, capsys):
+    import socket
+    import threading
+
+    path = str(tmp_path / "timetrack.db")
+    socketPath = str(tmp_path / "timetrack.sock")
+    assert timetrack.forwardToDaemon(["--db", path, "morning"], socketPath) is None
+    listener = socket.socket(socket.AF_UNIX)
+    listener.bind(socketPath)
+    listener.listen()
+
+    def serveOne(reply):
+        client, _ = listener.accept()
+        with client, client.makefile("rwb") as stream:
+            if reply:
+                con = timetrack.dbSetup(path=path)
+                timetrack.Daemon(con, listener).handle(stream)
+                con.close()
+            else:
+                stream.readline()
+                stalled.wait()
+
+    with listener:
+        daemon = threading.Thread(target=serveOne, args=(True,))
+        daemon.start()
+        assert timetrack.forwardToDaemon(["--db", path, "morning"], socketPath) == 0
+        daemon.join()
+        assert capsys.readouterr().out
+
+        # a daemon that takes the request and never answers may have run it
+        monkeypatch.setattr(timetrack, "DAEMON_REPLY_TIMEOUT", 0.1)
+        stalled = threading.Event()
+        daemon = threading.Thread(target=serveOne, args=(False,))
+        daemon.start()
+        assert timetrack.forwardToDaemon(["--db", path, "break"], socketPath) == 1
+        stalled.set()
+        daemon.join()
+        assert "Lost the connection to the daemon" in capsys.readouterr().err
+
+
+def importDays(con, tmp_path, days):
+    """Import a regular work day from 8:00 to 16:30 with a break at noon for each of
+    days."""
+    lines = []
+    for day in days:
+        for type, hour, minute in [
+            (timetrack.ACT_ARRIVE, 8, 0),
+            (timetrack.ACT_BREAK, 12, 0),
+            (timetrack.ACT_RESUME, 12, 30),
+            (timetrack.ACT_LEAVE, 16, 30),
+        ]:
+            lines.append(f"{type},{datetime.combine(day, time(hour, minute))}\n")
+    path = tmp_path / "entries.csv"
+    path.write_text("".join(lines))
+    timetrack.importEntries(con, str(path))
+
+
+def test_report_results_are_plain_data(tmp_path):
+    import json
+
+    con = timetrack.dbSetup(path=str(tmp_path / "timetrack.db"))
+    period = timetrack.Period.of("week", -1)
+    importDays(con, tmp_path, [period.start, period.start + timedelta(days=1)])
+    report = timetrack.computePeriod(con, period)
+    plain = report.plain()
+    assert json.loads(timetrack.renderJson(report)) == plain
+    assert (plain["start"], plain["work"], plain["days_worked"]) == (period.start.isoformat(), 16 * 60, 2)
+    assert [day["work"] for day in plain["days"] if day["work"]] == [8 * 60, 8 * 60]
+    assert timetrack.renderCsv(report).splitlines()[0] == ",".join(timetrack.DayRecord.COLUMNS)
+
+    plain = timetrack.computeDay(con, -30).plain()
+    assert plain["work"] is None and plain["leave_at"] is None and plain["entries"] == []
+    con.close()
+
+
+def test_analysis_agrees_with_the_reports(tmp_path):
+    pytest.importorskip("numpy")
+    con = timetrack.dbSetup(path=str(tmp_path / "timetrack.db"))
+    monday = timetrack.Period.of("week", -2).start
+    days = [monday, monday + timedelta(days=1), monday + timedelta(days=3)]
+    importDays(con, tmp_path, days)
+    report = timetrack.computeAnalysis(con)
+    assert (report.start, report.end, report.days) == (days[0], days[-1], 3)
+    assert set(report.percentiles["arrival"]) == {8 * 60} and set(report.percentiles["leave"]) == {16 * 60 + 30}
+    assert set(report.percentiles["work"]) == {8 * 60} and set(report.percentiles["break"]) == {30}
+    assert report.balance["total"] == timetrack.computeBalance(con, days[0], days[-1]).plain()["balance"]
+    assert report.streaks["worked"] == (2, days[0], days[1])
+    con.close()
+
+
+def test_ledger_balance_matches_the_days(tmp_path):
+    con = timetrack.dbSetup(path=str(tmp_path / "timetrack.db"))
+    monday = timetrack.Period.of("week", -6).start
+    worked = [monday + timedelta(days=n) for n in range(35) if n % 7 < 5 and n % 4]
+    importDays(con, tmp_path, worked)
+    # vacation after the fact, which moves the totals of every later day
+    timetrack.setCalendarDays(con, [(monday + timedelta(days=8), 0, "vacation")])
+
+    def bruteForce(start, end):
+        work = sum(8 * 60 for day in worked if start <= day <= end)
+        calendar = timetrack.calendarDays(con, start, end + timedelta(days=1))
+        # days without entries count, except those before the first or still to come
+        return work, sum(expected for day, (expected, _) in calendar.items() if worked[0] <= day < date.today())
+
+    for start, end in [(monday, monday + timedelta(days=34)), (worked[0], worked[-1])] + [
+        (monday + timedelta(days=first), monday + timedelta(days=first + length))
+        for first in range(0, 35, 3)
+        for length in [0, 1, 6, 20]
+    ]:
+        report = timetrack.computeBalance(con, start, end)
+        assert (timetrack.minutes(report.total), timetrack.minutes(report.expected)) == bruteForce(start, end)
+    con.close()
+
+
+def test_watch_requeries_only_after_changes(tmp_path, monkeypatch, capsys):
+    path = str(tmp_path / "timetrack.db")
+    con = timetrack.dbSetup(path=path)
+    other = timetrack.dbSetup(path=path)
+    queries = []
+    getEntries = timetrack.getEntries
+    monkeypatch.setattr(timetrack, "getEntries", lambda con, day: queries.append(day) or getEntries(con, day))
+    sleeps = []
+
+    def sleep(interval):
+        sleeps.append(interval)
+        if len(sleeps) == 1:
+            timetrack.punch(other, timetrack.ACT_ARRIVE)
+        elif len(sleeps) == 3:
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr("time.sleep", sleep)
+    timetrack.watchDay(con, interval=0.5)
+    assert sleeps == [0.5, 0.5, 0.5] and len(queries) == 2
+    out = capsys.readouterr().out
+    assert out.startswith("There is no arrival on") and "arrive" in out and "\x1b[" not in out
+    other.close()
+    con.close()
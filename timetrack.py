@@ -1,19 +1,32 @@
 #!/usr/bin/env python
 # vim:ts=4:sts=4:sw=4:tw=80:et
 
-import argparse
+# Only what every punch needs is imported here. Punches are run from hooks all the
+# time, so modules needed by reports, servers and diagnostics only are imported
+# where they are used.
 import os
-import random
 import sqlite3
 import sys
+from bisect import bisect_right
 from collections.abc import Callable
+from contextlib import contextmanager
 from datetime import date, datetime, time, timedelta
+from itertools import islice
+from time import perf_counter, process_time
 
 ACT_ARRIVE = "arrive"
 ACT_BREAK = "break"
 ACT_RESUME = "resume"
 ACT_LEAVE = "leave"
 
+# Types of the previous entry each type of entry may follow
+TRANSITIONS = {
+    ACT_ARRIVE: [None, ACT_LEAVE],
+    ACT_BREAK: [ACT_ARRIVE, ACT_RESUME],
+    ACT_RESUME: [ACT_BREAK],
+    ACT_LEAVE: [ACT_ARRIVE, ACT_RESUME],
+}
+
 
 MSG_ERR_NOT_WORKING = 1 << 0
 MSG_ERR_HAVE_NOT_LEFT = 1 << 1
@@ -23,10 +36,105 @@ MSG_SUCCESS_BREAK = 1 << 4
 MSG_SUCCESS_RESUME = 1 << 5
 MSG_SUCCESS_LEAVE = 1 << 6
 
+# Error message for an entry of the given type not allowed by TRANSITIONS
+MSG_ERR_TRANSITION = {
+    ACT_ARRIVE: MSG_ERR_HAVE_NOT_LEFT,
+    ACT_BREAK: MSG_ERR_NOT_WORKING,
+    ACT_RESUME: MSG_ERR_NOT_BREAKING,
+    ACT_LEAVE: MSG_ERR_NOT_WORKING,
+}
+
 
 DAY_HOURS = 8
 WEEK_HOURS = DAY_HOURS * 5
 
+# Kinds of days in the calendar, with the work minutes expected on them by default.
+# Part-time days have no default, their minutes are always given.
+CALENDAR_KINDS = {
+    "workday": DAY_HOURS * 60,
+    "weekend": 0,
+    "holiday": 0,
+    "vacation": 0,
+    "sick": 0,
+    "part-time": None,
+}
+
+
+DB_VERSION = 9
+
+DB_PATH = os.environ.get("TIMETRACK_DB", "~/timetrack.db")
+
+# Values of flags in the environment that turn them off, all others turn them on
+FALSE_FLAGS = ["", "0", "no", "false", "off"]
+
+# Diagnostics for cron jobs and hooks, see the --profile, --trace-sql and
+# --startup-time options. The profile is only parsed along with the command line,
+# so a malformed value is reported like any other bad argument.
+PROFILE = os.environ.get("TIMETRACK_PROFILE", "0")
+# Functions printed by --profile unless a number is given
+PROFILE_ROWS = 20
+TRACE_SQL = os.environ.get("TIMETRACK_TRACE_SQL", "0").strip().lower() not in FALSE_FLAGS
+STARTUP_TIME = os.environ.get("TIMETRACK_STARTUP_TIME", "0").strip().lower() not in FALSE_FLAGS
+
+# Milliseconds to wait for other processes to release their lock on the database,
+# unless --busy-timeout or $TIMETRACK_BUSY_TIMEOUT says otherwise
+BUSY_TIMEOUT = 5000
+
+IMPORT_BATCH_SIZE = 10000
+# Imported timestamps outside of these are rejected, most likely they are epoch
+# seconds or some other unit instead of microseconds
+IMPORT_RANGE = [datetime(1971, 1, 1), datetime(2200, 1, 1)]
+
+# Unix domain socket the serve action listens on, and the other actions forward to
+SOCKET_PATH = os.environ.get("TIMETRACK_SOCKET", "~/.timetrack.sock")
+# Seconds a client may take to connect to the daemon and send its request, after
+# which the daemon moves on to the next one and the client runs the action itself
+DAEMON_REQUEST_TIMEOUT = 2
+# Seconds a client waits for the daemon to answer its request
+DAEMON_REPLY_TIMEOUT = 60
+# Actions a running daemon answers, everything else always runs directly
+DAEMON_ACTIONS = [
+    "morning",
+    "break",
+    "resume",
+    "continue",
+    "closing",
+    "day",
+    "week",
+    "month",
+    "quarter",
+    "year",
+    "report",
+    "summary",
+    "balance",
+    "team",
+]
+
+# Message catalog replacing the built-in messages, or a directory of them by locale
+MESSAGES_PATH = os.environ.get("TIMETRACK_MESSAGES", "~/.timetrack-messages")
+
+# Line printed by the status action, see statusFields() for the fields available
+STATUS_FORMAT = os.environ.get("TIMETRACK_STATUS_FORMAT", "{state} {duration}, {worked} today")
+# Seconds after which the status snapshot is read from the database again, in case
+# the entries were changed by something else than timetrack
+STATUS_MAX_AGE = 3600
+# State shown by the status action for the type of the latest entry
+STATUS_STATES = {None: "none", ACT_ARRIVE: "working", ACT_BREAK: "break", ACT_RESUME: "working", ACT_LEAVE: "gone"}
+
+
+# Timestamps are stored either as ISO 8601 text or as integer microseconds since
+# 1970-01-01 (of the naive local time, so the conversion is lossless).
+TS_ISO = "iso"
+TS_EPOCH = "epoch"
+TS_EPOCH_ORIGIN = datetime(1970, 1, 1)
+
+# All columns holding timestamps, which need converting along with the format
+TS_COLUMNS = {
+    "times": ["ts"],
+    "state": ["ts"],
+    "daily_summary": ["arrived_at", "left_at"],
+}
+
 
 class ProgramAbortError(Exception):
     """Exception class that wraps a critical error and encapsules it for pretty-printing of the error message."""
@@ -57,261 +165,999 @@ def error(msg, ex):
     raise ProgramAbortError(msg, ex)
 
 
-def randomMessage(type, *args):
-    messageList = []
-
-    ###########
-    # Arrival #
-    ###########
-    if type == MSG_SUCCESS_ARRIVAL:
-        if len(args) > 0:
-            arrivalTime = args[0]
-            if arrivalTime.hour <= 7:
-                messageList.append("The early bird catches the worm. Welcome and have a nice day!")
-            elif arrivalTime.hour <= 9:
-                messageList.append("Good morning.")
-            elif arrivalTime.hour >= 10:
-                messageList.append("Coming in late today? Have fun working anyway.")
-
-            if arrivalTime.weekday() == 0:  # Monday
-                messageList.append("Have a nice start into the fresh week!")
-                messageList.append("New week, new luck!")
-            elif arrivalTime.weekday() == 4:  # Friday
-                messageList.append("Last day of the week! Almost done! Keep going!")
-                messageList.append("Just a couple more hours until weekend. Have fun!")
-            elif arrivalTime.weekday() == 5:  # Saturday
-                messageList.append("Oh, so they made you work on Saturday? I'm sorry :/")
-                messageList.append("Saturday, meh. Hang in there, it'll be over soon.")
-
-        messageList.append("Welcome and have a nice day!")
-
-    #########
-    # Break #
-    #########
-    elif type == MSG_SUCCESS_BREAK:
-        breakTime = None
-        workStartTime = None
-        if len(args) > 0:
-            breakTime = args[0]
-        if len(args) > 1:
-            workStartTime = args[1]
-
-        if breakTime is not None and workStartTime is not None:
-            duration = breakTime - workStartTime
-            durationHours = int(duration.total_seconds() // 3600)
-            durationMinutes = int((duration.total_seconds() - (durationHours * 3600)) // 60)
-            msgText = ""
-            if durationHours > 1:
-                msgText += "{:d} hours".format(durationHours)
-            elif durationHours == 1:
-                msgText += "{:d} hour".format(durationHours)
-
-            # avoid 1 hour 2 minutes
-            if durationHours > 0 and durationMinutes > 2:
-                msgText += " and "
-
-            if durationHours == 0 or durationMinutes > 2:
-                if durationMinutes > 1:
-                    msgText += "{:02d} minutes".format(durationMinutes)
-                else:
-                    msgText += "{:02d} minutes".format(durationMinutes)
-
-            msgText += " of work."
-
-            # more than 4h, time for a break
-            if duration.total_seconds() >= 4 * 60 * 60:
-                msgText += " Time for a well-deserved break."
-            else:
-                msgText += " I guess a coffee break wouldn't hurt, would it?"
-
-            messageList.append(msgText)
-
-        if breakTime is not None:
-            if breakTime.hour >= 11 and breakTime.hour <= 13:
-                messageList.append("{:%H:%M}. A good time for lunch.".format(breakTime))
-            if breakTime.hour < 11:
-                messageList.append("{0.hour} o'clock. Breakfast time!".format(breakTime))
-            if breakTime.hour > 13:
-                messageList.append("Coffee?")
-                messageList.append("Good idea, take a break and relax a little.")
-
-        messageList.append("Enjoy your break!")
-        messageList.append("Relax a little and all your problems will have gotten simpler once you're back :-)")
-        messageList.append("Bye bye!")
-
-    ################
-    # End of break #
-    ################
-    elif type == MSG_SUCCESS_RESUME:
-        resumeTime = None
-        breakStartTime = None
-        if len(args) > 0:
-            resumeTime = args[0]
-        if len(args) > 1:
-            breakStartTime = args[1]
-
-        if resumeTime is not None:
-            if resumeTime.hour <= 12:
-                messageList.append("With renewed vigour into the rest of the day! Welcome back.")
-                messageList.append("The rest of the day right ahead, but with fresh strength.")
-            elif resumeTime.hour >= 15:
-                messageList.append("Just a few more hours. Hang in, closing time is near!")
-                messageList.append("Almost there. Just a few more minutes.")
-
-        if resumeTime is not None and breakStartTime is not None:
-            duration = resumeTime - breakStartTime
-            durationMinutes = int(duration.total_seconds() // 60)
-
-            msgText = "{:d}".format(durationMinutes)
-            if durationMinutes != 1:
-                msgText += " minutes"
-            else:
-                msgText += " minute"
-            msgText += " break. Welcome back and have fun with the rest of"
-            msgText += " your day."
-            messageList.append(msgText)
-
-            if durationMinutes < 30:
-                messageList.append("Quick coffee break finished? Back to work, getting things done!")
-                messageList.append("That break certainly was a quick one! Welcome back!")
-            elif durationMinutes >= 30 and durationMinutes < 45:
-                messageList.append("Average size break, now back to work.")
-            else:
-                messageList.append("That was a pretty long break. You can pull off more then 9 hours today.")
-                messageList.append(
-                    f"Pretty extensive {durationMinutes} minute break. Hope you're feeling refreshed now :)"
+# Built-in message catalog. Every type of message has a list of candidates, one of
+# which is picked at random. A candidate is used if all of its conditions hold:
+#   hours:    [first, last] hour of the time of the entry, either may be None
+#   weekdays: weekdays of the time of the entry, 0 is Monday
+#   minutes:  [first, last] minutes since the previous entry, either may be None
+#   previous: types of the previous entry (for the error messages)
+#   fallback: only used if no other candidate is
+# The text is formatted with time and since (the times of the entry and the one
+# before it), minutes (between them) and worked (the same, spelled out).
+MESSAGES = {
+    "arrival": [
+        {"text": "The early bird catches the worm. Welcome and have a nice day!", "hours": [None, 7]},
+        {"text": "Good morning.", "hours": [8, 9]},
+        {"text": "Coming in late today? Have fun working anyway.", "hours": [10, None]},
+        {"text": "Have a nice start into the fresh week!", "weekdays": [0]},
+        {"text": "New week, new luck!", "weekdays": [0]},
+        {"text": "Last day of the week! Almost done! Keep going!", "weekdays": [4]},
+        {"text": "Just a couple more hours until weekend. Have fun!", "weekdays": [4]},
+        {"text": "Oh, so they made you work on Saturday? I'm sorry :/", "weekdays": [5]},
+        {"text": "Saturday, meh. Hang in there, it'll be over soon.", "weekdays": [5]},
+        {"text": "Welcome and have a nice day!"},
+    ],
+    "break": [
+        {"text": "{worked} of work. Time for a well-deserved break.", "minutes": [4 * 60, None]},
+        {"text": "{worked} of work. I guess a coffee break wouldn't hurt, would it?", "minutes": [None, 4 * 60 - 1]},
+        {"text": "{time:%H:%M}. A good time for lunch.", "hours": [11, 13]},
+        {"text": "{time.hour} o'clock. Breakfast time!", "hours": [None, 10]},
+        {"text": "Coffee?", "hours": [14, None]},
+        {"text": "Good idea, take a break and relax a little.", "hours": [14, None]},
+        {"text": "Enjoy your break!"},
+        {"text": "Relax a little and all your problems will have gotten simpler once you're back :-)"},
+        {"text": "Bye bye!"},
+    ],
+    "resume": [
+        {"text": "With renewed vigour into the rest of the day! Welcome back.", "hours": [None, 12]},
+        {"text": "The rest of the day right ahead, but with fresh strength.", "hours": [None, 12]},
+        {"text": "Just a few more hours. Hang in, closing time is near!", "hours": [15, None]},
+        {"text": "Almost there. Just a few more minutes.", "hours": [15, None]},
+        {"text": "{minutes:d} minute break. Welcome back and have fun with the rest of your day.", "minutes": [1, 1]},
+        {
+            "text": "{minutes:d} minutes break. Welcome back and have fun with the rest of your day.",
+            "minutes": [None, 0],
+        },
+        {
+            "text": "{minutes:d} minutes break. Welcome back and have fun with the rest of your day.",
+            "minutes": [2, None],
+        },
+        {"text": "Quick coffee break finished? Back to work, getting things done!", "minutes": [None, 29]},
+        {"text": "That break certainly was a quick one! Welcome back!", "minutes": [None, 29]},
+        {"text": "Average size break, now back to work.", "minutes": [30, 44]},
+        {"text": "That was a pretty long break. You can pull off more then 9 hours today.", "minutes": [45, None]},
+        {
+            "text": "Pretty extensive {minutes} minute break. Hope you're feeling refreshed now :)",
+            "minutes": [45, None],
+        },
+        {"text": "Welcome back at your desk. Your laptop has been missing you."},
+        {"text": "Back into work! Enjoy!"},
+        {"text": "Welcome back."},
+    ],
+    "leave": [
+        {"text": "Going home early today? Go ahead, I'm sure you earned it.", "hours": [None, 14]},
+        {"text": "Short work day, enjoy your afternoon.", "hours": [None, 14]},
+        {"text": "Have a nice evening.", "hours": [15, 17]},
+        {"text": "Bon appetit and enjoy your evening!", "hours": [15, 17]},
+        {"text": "Leaving late today?", "hours": [18, None]},
+        {
+            "text": "Did you just stay because the job was interesting or did something have to get done today?",
+            "hours": [18, None],
+        },
+        {"text": "Finally. Have a good night's sleep!", "hours": [18, None]},
+        {"text": "Friday! Have a nice weekend!", "weekdays": [4]},
+        {"text": "Finally, this week has come to an end.", "weekdays": [4]},
+        {"text": "Fuck this shit, it's Friday and I'm going home!", "weekdays": [4]},
+        {"text": "Ugh, somebody made you come in on Saturday. Enjoy your Sunday then.", "weekdays": [5]},
+        {"text": "About time the week was over, isn't it?", "weekdays": [5]},
+        {"text": "A good time to leave. Because it's always a good time to do that. :)"},
+        {"text": "You're right, go home. Tomorrow's yet another day."},
+    ],
+    "not-working": [
+        {
+            "text": "You can't leave or take a break if you're not here in the first place."
+            " You are currently taking a break.",
+            "previous": [ACT_BREAK],
+        },
+        {
+            "text": "You can't leave or take a break if you're not here in the first place."
+            " According to my data, you're still at home.",
+            "previous": [ACT_LEAVE],
+        },
+        {"text": "You can't leave or take a break if you're not here in the first place.", "fallback": True},
+    ],
+    "not-breaking": [
+        {
+            "text": "You can't continue working if you're not currently taking a break."
+            " My data says you're here and working.",
+            "previous": [ACT_ARRIVE, ACT_RESUME],
+        },
+        {
+            "text": "You can't continue working if you're not currently taking a break."
+            " According to my data, you're still at home.",
+            "previous": [ACT_LEAVE],
+        },
+        {"text": "You can't continue working if you're not currently taking a break.", "fallback": True},
+    ],
+    "have-not-left": [
+        {
+            "text": "You cannot start your day when you're already (or still?) here."
+            " My data says you're here and working.",
+            "previous": [ACT_ARRIVE, ACT_RESUME],
+        },
+        {
+            "text": "You cannot start your day when you're already (or still?) here. It seems you're taking a break.",
+            "previous": [ACT_BREAK],
+        },
+        {"text": "You cannot start your day when you're already (or still?) here.", "fallback": True},
+    ],
+}
+
+# Names of the message types in catalogs
+MESSAGE_TYPES = {
+    MSG_SUCCESS_ARRIVAL: "arrival",
+    MSG_SUCCESS_BREAK: "break",
+    MSG_SUCCESS_RESUME: "resume",
+    MSG_SUCCESS_LEAVE: "leave",
+    MSG_ERR_NOT_WORKING: "not-working",
+    MSG_ERR_NOT_BREAKING: "not-breaking",
+    MSG_ERR_HAVE_NOT_LEFT: "have-not-left",
+}
+# Types of messages that are formatted with the time of their entry, and those that
+# are also formatted with the time of the entry before it
+TIMED_MESSAGES = ["arrival", "break", "resume", "leave"]
+PAIRED_MESSAGES = ["break", "resume"]
+
+
+def workedText(duration):
+    """Spell out a duration of work, leaving out a couple of minutes past the hour."""
+    hours, rest = divmod(int(duration.total_seconds()), 3600)
+    minutes = rest // 60
+    text = ""
+    if hours > 1:
+        text += "{:d} hours".format(hours)
+    elif hours == 1:
+        text += "1 hour"
+    # avoid 1 hour 2 minutes
+    if hours > 0 and minutes > 2:
+        text += " and "
+    if hours == 0 or minutes > 2:
+        text += "{:02d} minutes".format(minutes)
+    return text
+
+
+class MessageCatalog:
+    """Message candidates compiled for quick selection. The conditions of a type only
+    change at a few hours and durations, which split the day and the durations into
+    buckets. The candidates for every combination of hour bucket, weekday, duration
+    bucket and previous entry are filtered once, on first use, and looked up in a dict
+    from then on."""
+
+    def __init__(self, messages):
+        self.messages = messages
+        self.hourBuckets = {}
+        self.minuteBounds = {}
+        for name, candidates in messages.items():
+            hourBounds = set()
+            minuteBounds = set()
+            for candidate in candidates:
+                first, last = candidate.get("hours") or [None, None]
+                hourBounds.update([first or 0, 24 if last is None else last + 1])
+                first, last = candidate.get("minutes") or [None, None]
+                if first is not None:
+                    minuteBounds.add(first)
+                if last is not None:
+                    minuteBounds.add(last + 1)
+            hourBounds = sorted(hourBounds)
+            self.hourBuckets[name] = [bisect_right(hourBounds, hour) for hour in range(24)]
+            self.minuteBounds[name] = sorted(minuteBounds)
+        self.compiled = {}
+
+    def candidates(self, name, ts=None, since=None, previous=None):
+        """Return the candidate texts of a type for the given times and previous entry."""
+        hourBucket = weekday = minuteBucket = None
+        if ts is not None:
+            hourBucket = self.hourBuckets[name][ts.hour]
+            weekday = ts.weekday()
+            if since is not None:
+                minuteBucket = bisect_right(self.minuteBounds[name], (ts - since) // timedelta(minutes=1))
+        key = (name, hourBucket, weekday, minuteBucket, previous)
+        texts = self.compiled.get(key)
+        if texts is None:
+            texts = self.compiled[key] = self.select(name, ts, since, previous)
+        return texts
+
+    def select(self, name, ts, since, previous, candidates=None):
+        """Filter the candidates of a type by their conditions. A user catalog need not
+        cover every time and previous entry, the built-in candidates fill its gaps."""
+        minutes = None if ts is None or since is None else (ts - since) // timedelta(minutes=1)
+        texts = []
+        fallbacks = []
+        for candidate in self.messages[name] if candidates is None else candidates:
+            hours = candidate.get("hours")
+            if hours is not None and (ts is None or not inRange(ts.hour, hours)):
+                continue
+            weekdays = candidate.get("weekdays")
+            if weekdays is not None and (ts is None or ts.weekday() not in weekdays):
+                continue
+            minuteRange = candidate.get("minutes")
+            if minuteRange is not None and (minutes is None or not inRange(minutes, minuteRange)):
+                continue
+            if "previous" in candidate and previous not in candidate["previous"]:
+                continue
+            (fallbacks if candidate.get("fallback") else texts).append(candidate["text"])
+        if not texts and not fallbacks and candidates is None and self.messages[name] is not MESSAGES[name]:
+            return self.select(name, ts, since, previous, MESSAGES[name])
+        return tuple(texts or fallbacks)
+
+    def randomMessage(self, name, ts=None, since=None, previous=None):
+        import random
+
+        text = random.choice(self.candidates(name, ts, since, previous))
+        minutes = None if ts is None or since is None else (ts - since) // timedelta(minutes=1)
+        worked = None if minutes is None else workedText(ts - since)
+        return text.format(time=ts, since=since, minutes=minutes, worked=worked)
+
+
+def inRange(value, bounds):
+    first, last = bounds
+    return (first is None or value >= first) and (last is None or value <= last)
+
+
+def messageLocales():
+    """Return the locales to look for a message catalog of, most specific first."""
+    for variable in ["TIMETRACK_LOCALE", "LC_ALL", "LC_MESSAGES", "LANG"]:
+        value = os.environ.get(variable)
+        if value:
+            locale = value.split(".")[0].split("@")[0]
+            if locale in ["C", "POSIX"]:
+                return []
+            return list(dict.fromkeys([locale, locale.split("_")[0]]))
+    return []
+
+
+def checkMessages(messages):
+    """Raise ValueError if a user supplied catalog is malformed."""
+    if not isinstance(messages, dict):
+        raise ValueError("expected an object of message types")
+    for name, candidates in messages.items():
+        if name not in MESSAGES:
+            raise ValueError(f"unknown message type {name!r}")
+        if not isinstance(candidates, list) or not candidates:
+            raise ValueError(f"expected a list of candidates for {name!r}")
+        for candidate in candidates:
+            if not isinstance(candidate, dict) or not isinstance(candidate.get("text"), str):
+                raise ValueError(f"expected candidates with a text for {name!r}")
+            unknown = set(candidate) - {"text", "hours", "weekdays", "minutes", "previous", "fallback"}
+            if unknown:
+                raise ValueError(f"unknown condition {sorted(unknown)[0]!r} for {name!r}")
+            for bounds in [candidate.get("hours"), candidate.get("minutes")]:
+                if bounds is not None and (
+                    not isinstance(bounds, list)
+                    or len(bounds) != 2
+                    or not all(bound is None or isinstance(bound, int) for bound in bounds)
+                ):
+                    raise ValueError(f"expected [first, last] bounds for {name!r}")
+            weekdays = candidate.get("weekdays", [])
+            if not isinstance(weekdays, list) or not all(weekday in range(7) for weekday in weekdays):
+                raise ValueError(f"expected a list of weekdays from 0 to 6 for {name!r}")
+            previous = candidate.get("previous", [])
+            if not isinstance(previous, list) or not all(type in TRANSITIONS or type is None for type in previous):
+                raise ValueError(f"expected a list of entry types for {name!r}")
+            # the texts are only formatted after the entry has been recorded
+            ts = datetime(2000, 1, 3, 12) if name in TIMED_MESSAGES else None
+            paired = name in PAIRED_MESSAGES
+            try:
+                candidate["text"].format(
+                    time=ts,
+                    since=ts - timedelta(hours=1) if paired else None,
+                    minutes=60 if paired else None,
+                    worked=workedText(timedelta(hours=1)) if paired else None,
                 )
+            except (AttributeError, IndexError, KeyError, TypeError, ValueError) as e:
+                raise ValueError(f"cannot format {candidate['text']!r} for {name!r}: {e!r}") from e
+
+
+def loadMessages(path=MESSAGES_PATH):
+    """Return the built-in message catalog, with the types found in a user catalog
+    replaced. path is either a JSON catalog or a directory of them named by locale
+    (de_DE.json, de.json), falling back to default.json. A missing or broken user
+    catalog leaves the built-in one in place."""
+    path = os.path.expanduser(path)
+    if os.path.isdir(path):
+        files = [os.path.join(path, f"{locale}.json") for locale in messageLocales() + ["default"]]
+        path = next((file for file in files if os.path.isfile(file)), None)
+    elif not os.path.isfile(path):
+        path = None
+    if path is None:
+        return MESSAGES
+
+    import json
+
+    try:
+        with open(path, encoding="utf-8") as f:
+            messages = json.load(f)
+        checkMessages(messages)
+    except (OSError, ValueError) as e:
+        warning(f"Ignoring the message catalog {path}: {e}")
+        return MESSAGES
+    return {**MESSAGES, **messages}
+
+
+# Loaded on the first message, then kept for the life of the process
+messageCatalog = None
 
-        messageList.append("Welcome back at your desk. Your laptop has been missing you.")
-        messageList.append("Back into work! Enjoy!")
-        messageList.append("Welcome back.")
-
-    ###################
-    # End of work day #
-    ###################
-    elif type == MSG_SUCCESS_LEAVE:
-        endTime = None
-        if len(args) > 0:
-            endTime = args[0]
-
-        if endTime is not None:
-            if endTime.hour <= 14:
-                messageList.append("Going home early today? Go ahead, I'm sure you earned it.")
-                messageList.append("Short work day, enjoy your afternoon.")
-            elif endTime.hour > 14 and endTime.hour < 18:
-                messageList.append("Have a nice evening.")
-                messageList.append("Bon appetit and enjoy your evening!")
-            else:
-                messageList.append("Leaving late today?")
-                messageList.append(
-                    "Did you just stay because the job was interesting or did something have to get done today?"
-                )
-                messageList.append("Finally. Have a good night's sleep!")
-            if endTime.weekday() == 4:  # Friday
-                messageList.append("Friday! Have a nice weekend!")
-                messageList.append("Finally, this week has come to an end.")
-                messageList.append("Fuck this shit, it's Friday and I'm going home!")
-            elif endTime.weekday() == 5:  # Saturday
-                messageList.append("Ugh, somebody made you come in on Saturday. Enjoy your Sunday then.")
-                messageList.append("About time the week was over, isn't it?")
-
-        messageList.append("A good time to leave. Because it's always a good time to do that. :)")
-        messageList.append("You're right, go home. Tomorrow's yet another day.")
-
-    ######################################################################
-    # Not currently working even though the requested action requires it #
-    ######################################################################
-    elif type == MSG_ERR_NOT_WORKING:
-        msg = "You can't leave or take a break if you're not here in the first place."
-        if len(args) > 0:
-            if args[0] == ACT_BREAK:
-                msg += " You are currently taking a break."
-            elif args[0] == ACT_LEAVE:
-                msg += " According to my data, you're still at home."
-        messageList.append(msg)
-
-    ####################################################################
-    # Not currently taking a break even though you requested to resume #
-    ####################################################################
-    elif type == MSG_ERR_NOT_BREAKING:
-        msg = "You can't continue working if you're not currently taking a break."
-        if len(args) > 0:
-            if args[0] in [ACT_ARRIVE, ACT_RESUME]:
-                msg += " My data says you're here and working."
-            elif args[0] == ACT_LEAVE:
-                msg += " According to my data, you're still at home."
-        messageList.append(msg)
-
-    ################################################
-    # Not at home, but requested to start your day #
-    ################################################
-    elif type == MSG_ERR_HAVE_NOT_LEFT:
-        msg = "You cannot start your day when you're already (or still?) here."
-        if len(args) > 0:
-            if args[0] in [ACT_ARRIVE, ACT_RESUME]:
-                msg += " My data says you're here and working."
-            elif args[0] == ACT_BREAK:
-                msg += " It seems you're taking a break."
-        messageList.append(msg)
-
-    return random.choice(messageList)
+
+def randomMessage(type, ts=None, since=None, previous=None):
+    """Pick a random message of the given type for the time of the entry and the one
+    before it, or for the type of the previous entry."""
+    global messageCatalog
+    if messageCatalog is None:
+        messageCatalog = MessageCatalog(loadMessages())
+    return messageCatalog.randomMessage(MESSAGE_TYPES[type], ts, since, previous)
 
 
 def adapt_datetime_iso(val):
     return val.isoformat(sep=" ", timespec="microseconds")
 
 
+def adapt_datetime_epoch(val):
+    return (val - TS_EPOCH_ORIGIN) // timedelta(microseconds=1)
+
+
 def convert_datetime(val):
+    # columns declared as TIMESTAMP have numeric affinity and keep both formats
+    if val.lstrip(b"-").isdigit():
+        return TS_EPOCH_ORIGIN + timedelta(microseconds=int(val))
     return datetime.fromisoformat(val.decode())
 
 
-def dbSetup():
-    """Create a new SQLite database in the user's home, creating and initializing
-    the database if it doesn't exist. Returns an sqlite3 connection object."""
-    con = sqlite3.connect(os.path.expanduser("~/timetrack.db"), detect_types=sqlite3.PARSE_DECLTYPES)
-    con.row_factory = sqlite3.Row
-    sqlite3.register_adapter(datetime, adapt_datetime_iso)
-    sqlite3.register_converter("timestamp", convert_datetime)
+def adapt_date_iso(val):
+    return val.isoformat()
+
+
+def convert_date(val):
+    return date.fromisoformat(val.decode())
+
+
+sqlite3.register_adapter(datetime, adapt_datetime_iso)
+sqlite3.register_converter("timestamp", convert_datetime)
+sqlite3.register_adapter(date, adapt_date_iso)
+sqlite3.register_converter("date", convert_date)
+
+
+class Connection(sqlite3.Connection):
+    """sqlite3 connection that knows how the timestamps of its database are stored,
+    and whose timeline (user and project) entries are recorded for and reported on.
+    Timestamps must be passed through adaptTs() before binding them to a query."""
+
+    timestamps = TS_ISO
+    user = ""
+    project = ""
+    tracer = None
+    # file of the database, None if it is in memory
+    path = None
+    # results memoized by cached(), only long running processes set this to a dict
+    memo = None
+    memoVersion = None
+
+    @contextmanager
+    def timeline(self, user, project):
+        """Temporarily switch to the timeline of another user and project."""
+        saved = self.user, self.project
+        self.user, self.project = user, project
+        try:
+            yield self
+        finally:
+            self.user, self.project = saved
+
+    @contextmanager
+    def savepoint(self, name):
+        """Run the statements of the block in a savepoint, for the writes read paths do
+        along the way. They are committed when the block ends unless a transaction was
+        open already, which is left open, and rolled back if the block raises."""
+        outermost = not self.in_transaction
+        self.execute(f"SAVEPOINT {name}")
+        try:
+            yield self
+            self.execute(f"RELEASE {name}")
+        except BaseException:
+            if outermost:
+                self.rollback()
+            elif self.in_transaction:
+                self.execute(f"ROLLBACK TO {name}")
+                self.execute(f"RELEASE {name}")
+            raise
+
+    def cached(self, key, compute):
+        """Return the result of compute() for the current timeline, memoized under key
+        as long as no other connection changed the database. Writes through this
+        connection must clear memo themselves, see bumpDataVersion()."""
+        if self.memo is None:
+            return compute()
+        version = self.execute("PRAGMA data_version").fetchone()[0]
+        if version != self.memoVersion:
+            self.memo.clear()
+            self.memoVersion = version
+        key = (self.user, self.project, *key)
+        if key not in self.memo:
+            self.memo[key] = compute()
+        return self.memo[key]
+
+    def adaptTs(self, val):
+        if val is None:
+            return None
+        if self.timestamps == TS_EPOCH:
+            return adapt_datetime_epoch(val)
+        return adapt_datetime_iso(val)
+
+
+class SqlTracer:
+    """Logs every SQL statement a connection executes to stderr, with its wall time
+    and the number of rows fetched or changed. sqlite3 only reports when statements
+    start, so both are accounted until the next statement starts, which includes the
+    time spent processing the rows in Python."""
+
+    def __init__(self, con, out=sys.stderr):
+        self.con = con
+        self.out = out
+        self.pending = None
+        self.rows = 0
+        self.statements = 0
+        self.duration = 0.0
+        self.rowFactory = con.row_factory
+        con.row_factory = self.countRow
+        con.set_trace_callback(self.trace)
+
+    def countRow(self, cursor, row):
+        self.rows += 1
+        return self.rowFactory(cursor, row) if self.rowFactory is not None else row
+
+    def trace(self, sql):
+        now = perf_counter()
+        self.flush(now)
+        self.pending = " ".join(sql.split()), now, self.con.total_changes
+        self.rows = 0
+
+    def flush(self, now):
+        if self.pending is None:
+            return
+        sql, start, changes = self.pending
+        rows = self.rows + self.con.total_changes - changes
+        print(f"SQL {(now - start) * 1000:>9.3f} ms {rows:>7d} rows  {sql}", file=self.out)
+        self.statements += 1
+        self.duration += now - start
+        self.pending = None
+
+    def close(self):
+        self.flush(perf_counter())
+        self.con.set_trace_callback(None)
+        self.con.row_factory = self.rowFactory
+        print(f"SQL {self.duration * 1000:>9.3f} ms in {self.statements} statements", file=self.out)
+
+
+def upgradeToV1(con):
+    """Database is uninitialized, create the tables we need."""
+    con.execute(
+        f"""
+            CREATE TABLE times (
+                  type TEXT NOT NULL CHECK (
+                       type == "{ACT_ARRIVE}"
+                    OR type == "{ACT_BREAK}"
+                    OR type == "{ACT_RESUME}"
+                    OR type == "{ACT_LEAVE}")
+                , ts TIMESTAMP NOT NULL
+                , PRIMARY KEY (type, ts)
+            )
+        """
+    )
+
+
+def upgradeToV2(con):
+    """Index the timestamps; every lookup of the last, first or a day's entries sorts
+    or filters by ts, which the (type, ts) primary key cannot serve."""
+    con.execute("CREATE INDEX times_ts ON times (ts)")
+
+
+def upgradeToV3(con):
+    """Materialize per-day totals, so reports don't have to replay the raw entries of
+    every day they cover."""
+    con.execute(
+        """
+            CREATE TABLE daily_summary (
+                  day DATE NOT NULL PRIMARY KEY
+                , arrived_at TIMESTAMP NOT NULL
+                , left_at TIMESTAMP
+                , work INTEGER
+                , pause INTEGER
+            ) WITHOUT ROWID
+        """
+    )
+    con.execute("CREATE INDEX daily_summary_open ON daily_summary (day) WHERE left_at IS NULL")
+    # filled by upgradeToV6, which changes the key of the table
+
+
+def upgradeToV4(con):
+    """Keep the most recent entry in a single-row table, so each punch can check the
+    current state with one primary key lookup."""
+    con.execute(
+        """
+            CREATE TABLE state (
+                  id INTEGER NOT NULL PRIMARY KEY CHECK (id == 0)
+                , type TEXT NOT NULL
+                , ts TIMESTAMP NOT NULL
+            )
+        """
+    )
+    con.execute("INSERT INTO state (id, type, ts) SELECT 0, type, ts FROM times ORDER BY ts DESC LIMIT 1")
+
+
+def upgradeToV5(con):
+    """Add a table for per-database settings, starting with the timestamp format."""
+    con.execute("CREATE TABLE settings (key TEXT NOT NULL PRIMARY KEY, value TEXT NOT NULL)")
+    con.execute("INSERT INTO settings (key, value) VALUES ('timestamps', ?)", (TS_ISO,))
+
+
+def upgradeToV6(con):
+    """Record entries per user and project, so a team can share one database. Each
+    pair of user and project is a timeline of its own, with its own state and daily
+    summaries. Existing data belongs to the empty user and project."""
+    con.execute(
+        f"""
+            CREATE TABLE times_v6 (
+                  user TEXT NOT NULL DEFAULT ''
+                , project TEXT NOT NULL DEFAULT ''
+                , type TEXT NOT NULL CHECK (
+                       type == "{ACT_ARRIVE}"
+                    OR type == "{ACT_BREAK}"
+                    OR type == "{ACT_RESUME}"
+                    OR type == "{ACT_LEAVE}")
+                , ts TIMESTAMP NOT NULL
+                , PRIMARY KEY (user, project, type, ts)
+            )
+        """
+    )
+    con.execute("INSERT INTO times_v6 (type, ts) SELECT type, ts FROM times")
+    con.execute("DROP TABLE times")
+    con.execute("ALTER TABLE times_v6 RENAME TO times")
+    con.execute("CREATE INDEX times_user_ts ON times (user, project, ts)")
+
+    con.execute(
+        """
+            CREATE TABLE state_v6 (
+                  user TEXT NOT NULL
+                , project TEXT NOT NULL
+                , type TEXT NOT NULL
+                , ts TIMESTAMP NOT NULL
+                , PRIMARY KEY (user, project)
+            ) WITHOUT ROWID
+        """
+    )
+    con.execute("INSERT INTO state_v6 (user, project, type, ts) SELECT '', '', type, ts FROM state")
+    con.execute("DROP TABLE state")
+    con.execute("ALTER TABLE state_v6 RENAME TO state")
+
+    con.execute("DROP TABLE daily_summary")
+    con.execute(
+        """
+            CREATE TABLE daily_summary (
+                  user TEXT NOT NULL
+                , project TEXT NOT NULL
+                , day DATE NOT NULL
+                , arrived_at TIMESTAMP NOT NULL
+                , left_at TIMESTAMP
+                , work INTEGER
+                , pause INTEGER
+                , PRIMARY KEY (user, project, day)
+            ) WITHOUT ROWID
+        """
+    )
+    con.execute("CREATE INDEX daily_summary_project_day ON daily_summary (project, day)")
+    con.execute("CREATE INDEX daily_summary_open ON daily_summary (user, project, day) WHERE left_at IS NULL")
+    for user, project in con.execute("SELECT DISTINCT user, project FROM times").fetchall():
+        with con.timeline(user, project):
+            storeDailySummary(con, getFirstTime(con).date(), getLastTime(con).date() + timedelta(days=1))
+
+
+def upgradeToV7(con):
+    """Add a cache for report totals of closed periods. Every timeline has a data
+    version that is bumped whenever its entries change, cached totals are only valid
+    for the data version they were computed at."""
+    con.execute(
+        """
+            CREATE TABLE data_version (
+                  user TEXT NOT NULL
+                , project TEXT NOT NULL
+                , version INTEGER NOT NULL
+                , PRIMARY KEY (user, project)
+            ) WITHOUT ROWID
+        """
+    )
+    con.execute("INSERT INTO data_version (user, project, version) SELECT DISTINCT user, project, 1 FROM times")
+    con.execute(
+        """
+            CREATE TABLE report_cache (
+                  user TEXT NOT NULL
+                , project TEXT NOT NULL
+                , start DATE NOT NULL
+                , end DATE NOT NULL
+                , version INTEGER NOT NULL
+                , work INTEGER NOT NULL
+                , workdays INTEGER NOT NULL
+                , PRIMARY KEY (user, project, start, end)
+            ) WITHOUT ROWID
+        """
+    )
+
+
+def upgradeToV8(con):
+    """Add a calendar with the expected work minutes and the kind of every day of
+    every timeline, filled with the default schedule for the years with entries.
+    The report cache now holds the expected minutes instead of the workdays worked,
+    so it starts over."""
+    con.execute(
+        f"""
+            CREATE TABLE calendar (
+                  user TEXT NOT NULL
+                , project TEXT NOT NULL
+                , day DATE NOT NULL
+                , expected INTEGER NOT NULL
+                , kind TEXT NOT NULL CHECK (kind IN ({", ".join(f"'{kind}'" for kind in CALENDAR_KINDS)}))
+                , PRIMARY KEY (user, project, day)
+            ) WITHOUT ROWID
+        """
+    )
+    years = con.execute(
+        """
+            SELECT user, project, CAST(substr(MIN(day), 1, 4) AS INTEGER), CAST(substr(MAX(day), 1, 4) AS INTEGER)
+            FROM daily_summary GROUP BY user, project
+        """
+    ).fetchall()
+    for user, project, first, last in years:
+        with con.timeline(user, project):
+            fillCalendar(con, first, last)
+
+    con.execute("DROP TABLE report_cache")
+    con.execute(
+        """
+            CREATE TABLE report_cache (
+                  user TEXT NOT NULL
+                , project TEXT NOT NULL
+                , start DATE NOT NULL
+                , end DATE NOT NULL
+                , version INTEGER NOT NULL
+                , work INTEGER NOT NULL
+                , expected INTEGER NOT NULL
+                , PRIMARY KEY (user, project, start, end)
+            ) WITHOUT ROWID
+        """
+    )
+
 
+def upgradeToV9(con):
+    """Add a ledger of the running totals of the work and the expected minutes of every
+    day of every timeline, from its first day with entries until its last closed one.
+    The balance of any range of days is the difference of two of its rows."""
+    con.execute(
+        """
+            CREATE TABLE ledger (
+                  user TEXT NOT NULL
+                , project TEXT NOT NULL
+                , day DATE NOT NULL
+                , work_total INTEGER NOT NULL
+                , expected_total INTEGER NOT NULL
+                , PRIMARY KEY (user, project, day)
+            ) WITHOUT ROWID
+        """
+    )
+    for user, project in con.execute("SELECT DISTINCT user, project FROM daily_summary").fetchall():
+        with con.timeline(user, project):
+            updateLedger(con, date.min)
+
+
+# Upgrades must only rely on the schema of the version before them. Derived tables
+# are rebuilt by the latest upgrade changing them.
+DB_UPGRADES = {
+    1: upgradeToV1,
+    2: upgradeToV2,
+    3: upgradeToV3,
+    4: upgradeToV4,
+    5: upgradeToV5,
+    6: upgradeToV6,
+    7: upgradeToV7,
+    8: upgradeToV8,
+    9: upgradeToV9,
+}
+
+
+def dbUpgrade(con):
+    """Apply all pending schema upgrades, one transaction per version. Yields the new
+    version and the time in seconds it took after each step."""
     dbVersion = con.execute("PRAGMA user_version").fetchone()["user_version"]
-    if dbVersion == 0:
-        # database is uninitialized, create the tables we need
+    if dbVersion > DB_VERSION:
+        error(f"Database version {dbVersion} is newer than the supported version {DB_VERSION}", None)
+    for version in range(dbVersion + 1, DB_VERSION + 1):
+        start = perf_counter()
         con.execute("BEGIN EXCLUSIVE")
-        con.execute(
-            f"""
-                CREATE TABLE times (
-                      type TEXT NOT NULL CHECK (
-                           type == "{ACT_ARRIVE}"
-                        OR type == "{ACT_BREAK}"
-                        OR type == "{ACT_RESUME}"
-                        OR type == "{ACT_LEAVE}")
-                    , ts TIMESTAMP NOT NULL
-                    , PRIMARY KEY (type, ts)
-                )
-            """
-        )
-        con.execute("PRAGMA user_version = 1")
-        con.commit()
-    # database upgrade code would go here
+        if con.execute("PRAGMA user_version").fetchone()["user_version"] >= version:
+            # another process applied this upgrade while we were waiting for the lock
+            con.rollback()
+            continue
+        try:
+            if version > 5:
+                # later upgrades read and write timestamps in the format of the database
+                con.timestamps = getSetting(con, "timestamps")
+            DB_UPGRADES[version](con)
+            con.execute(f"PRAGMA user_version = {version:d}")
+            con.commit()
+        except sqlite3.Error as e:
+            con.rollback()
+            error(f"Upgrading the database to version {version} failed", e)
+        yield version, perf_counter() - start
+
+
+def dbConnect(path, busyTimeout=BUSY_TIMEOUT, readOnly=False):
+    """Open the SQLite database at path without initializing or upgrading it."""
+    path = os.path.expanduser(path)
+    con = sqlite3.connect(
+        "file:{}?mode=ro".format(path.replace("?", "%3f").replace("#", "%23")) if readOnly else path,
+        timeout=busyTimeout / 1000,
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        factory=Connection,
+        uri=readOnly,
+    )
+    con.row_factory = sqlite3.Row
+    if path not in ["", ":memory:"]:
+        con.path = path
+    return con
 
+
+def dbOpenReadOnly(path, user="", project=""):
+    """Open an existing, up to date database for reading only. Returns an sqlite3
+    connection object whose reports are those of the given user and project."""
+    try:
+        con = dbConnect(path, readOnly=True)
+        dbVersion = con.execute("PRAGMA user_version").fetchone()["user_version"]
+    except sqlite3.Error as e:
+        error(f"Cannot open {path}", e)
+    if dbVersion != DB_VERSION:
+        con.close()
+        error(f"Database is at version {dbVersion}, run the migrate action on it first", None)
+    con.timestamps = getSetting(con, "timestamps")
+    con.user, con.project = user, project
     return con
 
 
-def addEntry(con, type, ts):
-    con.execute("INSERT INTO times (type, ts) VALUES (?, ?)", (type, ts))
-    con.commit()
+def dbSetup(upgrade=True, busyTimeout=BUSY_TIMEOUT, path=DB_PATH, user="", project="", traceSql=False):
+    """Open the SQLite database at path (in the user's home by default), creating and
+    initializing the database if it doesn't exist. Unless upgrade is False, pending
+    schema upgrades are applied. Returns an sqlite3 connection object whose entries
+    and reports are those of the given user and project. If traceSql is set, all
+    statements are logged until con.tracer is closed."""
+    con = dbConnect(path, busyTimeout)
+    if traceSql:
+        con.tracer = SqlTracer(con)
+    con.execute("PRAGMA synchronous = NORMAL")
+
+    dbVersion = con.execute("PRAGMA user_version").fetchone()["user_version"]
+    # An up to date database needs neither upgrades nor the journal mode, which is
+    # persistent and was set when it was opened the first time.
+    if dbVersion != DB_VERSION:
+        # Let report readers and punching writers work concurrently
+        con.execute("PRAGMA journal_mode = WAL")
+        if upgrade or dbVersion == 0:
+            # an uninitialized database always needs its tables
+            for dbVersion, _ in dbUpgrade(con):
+                if not upgrade:
+                    break
+    if dbVersion >= 5:
+        con.timestamps = getSetting(con, "timestamps")
+    con.user, con.project = user, project
 
+    return con
 
-def getLastType(con):
-    cur = con.execute("SELECT type FROM times ORDER BY ts DESC LIMIT 1")
-    row = cur.fetchone()
+
+def migrateDatabase(con):
+    """Upgrade the database schema to the latest version, reporting the time each
+    step took."""
+    total = 0.0
+    for version, duration in dbUpgrade(con):
+        message(f"Upgraded database to version {version} in {duration:.3f} s")
+        total += duration
+    if total:
+        message(f"Migration finished in {total:.3f} s")
+    else:
+        message(f"Database is already at version {DB_VERSION}, nothing to do")
+
+
+def getSetting(con, key):
+    row = con.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
     if row is None:
         return None
-    return row["type"]
+    return row["value"]
+
+
+def convertTimestamps(con, format):
+    """Convert all stored timestamps into the given format (TS_ISO or TS_EPOCH). The
+    conversion is verified to round-trip every value before anything is changed."""
+    if format == con.timestamps:
+        message(f"Timestamps are already stored as {format}")
+        return
+    adapt = adapt_datetime_epoch if format == TS_EPOCH else adapt_datetime_iso
+    restore = adapt_datetime_iso if format == TS_EPOCH else adapt_datetime_epoch
+
+    def convert(val):
+        return None if val is None else adapt(convert_datetime(str(val).encode()))
+
+    def roundTrip(val):
+        return None if val is None else restore(convert_datetime(str(convert(val)).encode()))
+
+    con.create_function("ts_convert", 1, convert, deterministic=True)
+    con.create_function("ts_round_trip", 1, roundTrip, deterministic=True)
+    start = perf_counter()
+    rows = 0
+    con.execute("BEGIN EXCLUSIVE")
+    try:
+        for table, columns in TS_COLUMNS.items():
+            for column in columns:
+                lost = con.execute(
+                    f"SELECT COUNT(*) FROM {table} WHERE {column} IS NOT ts_round_trip({column})"
+                ).fetchone()[0]
+                if lost:
+                    error(f"Converting {table}.{column} would change {lost} timestamps, aborting", None)
+                rows += con.execute(f"UPDATE {table} SET {column} = ts_convert({column})").rowcount
+        con.execute("UPDATE settings SET value = ? WHERE key = 'timestamps'", (format,))
+        con.commit()
+    except (sqlite3.Error, ProgramAbortError):
+        con.rollback()
+        raise
+    con.timestamps = format
+    # reclaim the space saved by the conversion
+    con.execute("VACUUM")
+    message(f"Converted {rows} timestamps to {format} in {perf_counter() - start:.3f} s")
+
+
+def updateState(con, type, ts):
+    # the state follows the latest entry by time, which an offset may have put in the past
+    con.execute(
+        """
+            INSERT INTO state (user, project, type, ts) VALUES (?, ?, ?, ?)
+            ON CONFLICT (user, project) DO UPDATE SET type = excluded.type, ts = excluded.ts
+            WHERE excluded.ts >= state.ts
+        """,
+        (con.user, con.project, type, con.adaptTs(ts)),
+    )
+
+
+def bumpDataVersion(con):
+    """Invalidate the cached reports of the current timeline. Must be called within
+    the transaction that modified its entries."""
+    con.execute(
+        """
+            INSERT INTO data_version (user, project, version) VALUES (?, ?, 1)
+            ON CONFLICT (user, project) DO UPDATE SET version = version + 1
+        """,
+        (con.user, con.project),
+    )
+    if con.memo is not None:
+        con.memo.clear()
+
+
+def statusPath(path):
+    """Return the path of the status snapshot kept next to the database at path."""
+    return os.path.expanduser(path) + "-status"
+
+
+def statusSnapshot(con, state=None):
+    """Return the status snapshot of the current timeline as a list of strings: the
+    type and time of its latest entry, the work day it belongs to and the seconds
+    worked on that day up to the entry. All but the seconds are empty if there are
+    no entries yet. state is the type and time of the latest entry, if known."""
+    type, ts = getState(con) if state is None else state
+    if ts is None:
+        return ["", "", "", "0"]
+    # unless the work day began before midnight
+    for day in [ts.date(), ts.date() - timedelta(days=1)]:
+        entries = con.execute(
+            "SELECT type, ts FROM times WHERE user = ? AND project = ? AND ts >= ? AND ts <= ? ORDER BY ts ASC",
+            (con.user, con.project, con.adaptTs(datetime.combine(day, time())), con.adaptTs(ts)),
+        ).fetchall()
+        record = summarizeEntries(day, entries, ts)
+        if record.arrivedAt is not None:
+            break
+    worked = int(record.workTime.total_seconds()) if record.hasData else 0
+    return [type, adapt_datetime_iso(ts), day.isoformat(), str(worked)]
+
+
+def storeStatus(con, snapshot):
+    """Replace the line of the current timeline in the status snapshot file of the
+    database by the given snapshot, or remove it if snapshot is None. The file is
+    replaced atomically, so the status action reads either the old or the new one.
+    Must be called with the database locked for writing, so concurrent writers can't
+    lose each other's lines."""
+    if con.path is None:
+        return
+    path = statusPath(con.path)
+    prefix = f"{con.user}\t{con.project}\t"
+    try:
+        with open(path, encoding="utf-8") as f:
+            lines = f.readlines()
+    except OSError:
+        lines = []
+    kept = [line for line in lines if not line.startswith(prefix)]
+    if snapshot is None and len(kept) == len(lines):
+        return
+    if snapshot is not None:
+        kept.append(prefix + "\t".join(snapshot) + "\n")
+    temporary = f"{path}.{os.getpid():d}"
+    try:
+        with open(temporary, "w", encoding="utf-8") as f:
+            f.writelines(kept)
+        os.replace(temporary, path)
+    except OSError as e:
+        warning(f"Cannot update the status snapshot {path}: {e}")
+
+
+def loadStatus(path, user, project):
+    """Return the status snapshot of a timeline from the snapshot file at path as
+    (type, ts, day, worked), or None if it is missing, unreadable or older than
+    STATUS_MAX_AGE."""
+    prefix = f"{user}\t{project}\t"
+    try:
+        with open(path, encoding="utf-8") as f:
+            if datetime.now().timestamp() - os.fstat(f.fileno()).st_mtime > STATUS_MAX_AGE:
+                return None
+            for line in f:
+                if line.startswith(prefix):
+                    return parseStatus(line[len(prefix) :].rstrip("\n").split("\t"))
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def parseStatus(snapshot):
+    """Convert a status snapshot as returned by statusSnapshot() into its values."""
+    type, ts, day, worked = snapshot
+    if not type:
+        return None, None, None, timedelta(0)
+    if type not in TRANSITIONS:
+        raise ValueError(f"Unknown entry type {type!r}")
+    return type, datetime.fromisoformat(ts), date.fromisoformat(day), timedelta(seconds=int(worked))
+
+
+def addEntry(con, type, ts, previous):
+    """Record an entry and commit it, previous being the type and time of the latest
+    entry before it."""
+    con.execute(
+        "INSERT INTO times (user, project, type, ts) VALUES (?, ?, ?, ?)",
+        (con.user, con.project, type, con.adaptTs(ts)),
+    )
+    updateState(con, type, ts)
+    bumpDataVersion(con)
+    updateDailySummary(con, ts.date())
+    if ts.time() == time():
+        # an entry at midnight also ends the previous day, see getEntries()
+        updateDailySummary(con, ts.date() - timedelta(days=1))
+    # written once, while the database is still locked so concurrent punches can't
+    # swap it, and removed again if the entry doesn't make it
+    latest = (type, ts) if previous[1] is None or ts >= previous[1] else previous
+    storeStatus(con, statusSnapshot(con, latest))
+    try:
+        con.commit()
+    except sqlite3.Error:
+        storeStatus(con, None)
+        raise
+
+
+def getState(con):
+    """Return the type and time of the most recent entry, or (None, None) if there is
+    none yet."""
+
+    def query():
+        row = con.execute(
+            "SELECT type, ts FROM state WHERE user = ? AND project = ?", (con.user, con.project)
+        ).fetchone()
+        if row is None:
+            return None, None
+        return row["type"], row["ts"]
+
+    return con.cached(("state",), query)
 
 
 def getLastTime(con):
-    cur = con.execute("SELECT ts FROM times ORDER BY ts DESC LIMIT 1")
+    cur = con.execute(
+        "SELECT ts FROM times WHERE user = ? AND project = ? ORDER BY ts DESC LIMIT 1", (con.user, con.project)
+    )
     row = cur.fetchone()
     if row is None:
         return None
@@ -319,22 +1165,37 @@ def getLastTime(con):
 
 
 def getFirstTime(con):
-    cur = con.execute("SELECT ts FROM times ORDER BY ts ASC LIMIT 1")
+    cur = con.execute(
+        "SELECT ts FROM times WHERE user = ? AND project = ? ORDER BY ts ASC LIMIT 1", (con.user, con.project)
+    )
     row = cur.fetchone()
     if row is None:
         return None
     return row["ts"]
 
 
+def punch(con, type, offset=0):
+    """Record an entry of the given type, offset minutes from now, if it may follow
+    the current state. The check and the insert happen in one write transaction, so
+    concurrent punches cannot both pass the check. Returns the time of the new entry
+    and the time of the one before it."""
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        lastType, lastTime = getState(con)
+        if lastType not in TRANSITIONS[type]:
+            error(randomMessage(MSG_ERR_TRANSITION[type], previous=lastType), None)
+        ts = datetime.now() + timedelta(minutes=offset)
+        addEntry(con, type, ts, (lastType, lastTime))
+    except BaseException:
+        con.rollback()
+        raise
+    return ts, lastTime
+
+
 def startTracking(con, offset=0):
     """Start your day: Records your arrival time in the morning."""
     # Make sure you're not already at work.
-    lastType = getLastType(con)
-    if lastType is not None and lastType != ACT_LEAVE:
-        error(randomMessage(MSG_ERR_HAVE_NOT_LEFT), None)
-
-    arrivalTime = datetime.now() + timedelta(minutes=offset)
-    addEntry(con, ACT_ARRIVE, arrivalTime)
+    arrivalTime, _ = punch(con, ACT_ARRIVE, offset)
     message(randomMessage(MSG_SUCCESS_ARRIVAL, arrivalTime))
 
 
@@ -342,13 +1203,7 @@ def suspendTracking(con, offset=0):
     """Suspend tracking for today: Records the start of your break time. There can
     be an infinite number of breaks per day."""
     # Make sure you're currently working; can't suspend if you weren't even working
-    lastType = getLastType(con)
-    lastTime = getLastTime(con)
-    if lastType not in [ACT_ARRIVE, ACT_RESUME]:
-        error(randomMessage(MSG_ERR_NOT_WORKING, lastType), None)
-
-    breakTime = datetime.now() + timedelta(minutes=offset)
-    addEntry(con, ACT_BREAK, breakTime)
+    breakTime, lastTime = punch(con, ACT_BREAK, offset)
     message(randomMessage(MSG_SUCCESS_BREAK, breakTime, lastTime))
 
 
@@ -356,61 +1211,258 @@ def resumeTracking(con, offset=0):
     """Resume tracking after a break. Records the end time of your break. There
     can be an infinite number of breaks per day."""
     # Make sure you're currently taking a break; can't resume if you were not taking a break
-    lastType = getLastType(con)
-    lastTime = getLastTime(con)
-    if lastType != ACT_BREAK:
-        error(randomMessage(MSG_ERR_NOT_BREAKING, lastType), None)
-
-    resumeTime = datetime.now() + timedelta(minutes=offset)
-    addEntry(con, ACT_RESUME, resumeTime)
+    resumeTime, lastTime = punch(con, ACT_RESUME, offset)
     message(randomMessage(MSG_SUCCESS_RESUME, resumeTime, lastTime))
 
 
 def endTracking(con, offset=0):
     """End tracking for the day. Records the time of your leave."""
     # Make sure you've actually been at work. Can't leave if you're not even here!
-    lastType = getLastType(con)
-    if lastType not in [ACT_ARRIVE, ACT_RESUME]:
-        error(randomMessage(MSG_ERR_NOT_WORKING, lastType), None)
-
-    leaveTime = datetime.now() + timedelta(minutes=offset)
-    addEntry(con, ACT_LEAVE, leaveTime)
+    leaveTime, _ = punch(con, ACT_LEAVE, offset)
     message(randomMessage(MSG_SUCCESS_LEAVE, leaveTime))
 
 
-def getEntries(con, d):
-    # Get the arrival for the date
-    cur = con.execute(
-        "SELECT ts FROM times WHERE type = ? AND ts >= ? AND ts < ? ORDER BY ts ASC LIMIT 1",
-        (ACT_ARRIVE, datetime.combine(d, time()), datetime.combine(d + timedelta(days=1), time())),
-    )
-    res = cur.fetchone()
-    if not res:
-        error("There is no arrival on {:%d.%m.%Y}".format(d), None)
-    startTime = res["ts"]
+def parseEntry(line, format):
+    """Parse a single CSV ("type,ts") or JSON Lines ({"type": ..., "ts": ...}) record.
+    Timestamps may be given in either storage format; those with a time zone are
+    converted to the local time. Raises ValueError if the line is malformed."""
+    import csv
+    import json
+
+    try:
+        if format == "jsonl":
+            record = json.loads(line)
+            type, ts = record["type"], record["ts"]
+        else:
+            type, ts = next(csv.reader([line]))
+        if type not in TRANSITIONS:
+            raise ValueError(f"unknown entry type {type!r}")
+        ts = convert_datetime(str(ts).encode())
+        if ts.tzinfo is not None:
+            ts = ts.astimezone().replace(tzinfo=None)
+        if not IMPORT_RANGE[0] <= ts < IMPORT_RANGE[1]:
+            raise ValueError(f"timestamp {ts} out of range")
+        return type, ts
+    except (KeyError, TypeError, StopIteration, OverflowError) as e:
+        raise ValueError(f"malformed record: {e}") from e
+
+
+def importEntries(con, file="-", format="auto", rejects=None):
+    """Bulk load entries from a CSV or JSON Lines file (or stdin) in a single
+    transaction. Every entry must follow the entries before it in time and obey the
+    same transitions the punch commands enforce; lines that don't are written to the
+    rejects file instead of aborting the import."""
+    if rejects is None:
+        rejects = "timetrack-import.rejects" if file == "-" else f"{file}.rejects"
+    lastType, lastTime = getState(con)
+    firstDay = lastTime.date() if lastTime is not None else None
+    imported = rejected = 0
+    rejectFile = None
+
+    def reject(line):
+        nonlocal rejected, rejectFile
+        if rejectFile is None:
+            try:
+                rejectFile = open(rejects, "w", encoding="utf-8")
+            except OSError as e:
+                error(f"Cannot write the rejected lines to {rejects}", e)
+        rejectFile.write(line if line.endswith("\n") else line + "\n")
+        rejected += 1
+
+    def acceptedEntries(stream):
+        nonlocal format, lastType, lastTime, firstDay, imported
+        for line in stream:
+            if not line.strip():
+                continue
+            if format == "auto":
+                format = "jsonl" if line.lstrip().startswith("{") else "csv"
+            if format == "csv" and imported == rejected == 0 and line.strip() == "type,ts":
+                continue  # header line
+            try:
+                type, ts = parseEntry(line, format)
+            except ValueError:
+                reject(line)
+                continue
+            if lastType not in TRANSITIONS[type] or (lastTime is not None and ts <= lastTime):
+                reject(line)
+                continue
+            lastType, lastTime = type, ts
+            if firstDay is None:
+                firstDay = ts.date()
+            imported += 1
+            yield con.user, con.project, type, con.adaptTs(ts)
+
+    start = perf_counter()
+    stream = None
+    try:
+        stream = sys.stdin if file == "-" else open(file, encoding="utf-8", newline="")
+        entries = acceptedEntries(stream)
+        con.execute("BEGIN IMMEDIATE")
+        while batch := list(islice(entries, IMPORT_BATCH_SIZE)):
+            con.executemany("INSERT INTO times (user, project, type, ts) VALUES (?, ?, ?, ?)", batch)
+        if imported:
+            updateState(con, lastType, lastTime)
+            bumpDataVersion(con)
+            refreshDailySummary(con, firstDay, lastTime.date() + timedelta(days=1))
+            storeStatus(con, statusSnapshot(con))
+        con.commit()
+    except ProgramAbortError:
+        con.rollback()
+        raise
+    except sqlite3.Error as e:
+        con.rollback()
+        # the snapshot may have been written already
+        storeStatus(con, None)
+        error("Importing the entries failed", e)
+    except OSError as e:
+        con.rollback()
+        error(f"Cannot read {file}", e)
+    finally:
+        if stream not in [None, sys.stdin]:
+            stream.close()
+        if rejectFile is not None:
+            rejectFile.close()
+
+    duration = perf_counter() - start
+    message(f"Imported {imported} entries in {duration:.3f} s ({imported / duration:.0f} rows/s)")
+    if rejected:
+        warning(f"Rejected {rejected} malformed or out of order lines, see {rejects}")
+
+
+def exportData(con, what="entries", format="csv", output="-", start=None, end=None):
+    """Stream the raw entries or the per-day totals, optionally limited to the days
+    from start to end (inclusive), as CSV or JSON Lines. Rows are written as they are
+    read, so memory use doesn't grow with the size of the exported period."""
+    import csv
+    import json
+
+    if what == "entries":
+        conditions, params = ["user = ?", "project = ?"], [con.user, con.project]
+        if start is not None:
+            conditions.append("ts >= ?")
+            params.append(con.adaptTs(datetime.combine(start, time())))
+        if end is not None:
+            conditions.append("ts < ?")
+            params.append(con.adaptTs(datetime.combine(end + timedelta(days=1), time())))
+        columns = ["type", "ts"]
+        cur = con.execute(f"SELECT type, ts FROM times WHERE {' AND '.join(conditions)} ORDER BY ts ASC", params)
+        rows = ((type, adapt_datetime_iso(ts)) for type, ts in cur)
+    else:
+        columns = DayRecord.COLUMNS
+        workDays = iterDailySummary(con, start or date.min, end + timedelta(days=1) if end is not None else date.max)
+        rows = (record.values() for record in workDays)
+
+    out = None
+    try:
+        out = sys.stdout if output == "-" else open(output, "w", encoding="utf-8", newline="")
+        if format == "jsonl":
+            for row in rows:
+                out.write(json.dumps(dict(zip(columns, row))))
+                out.write("\n")
+        else:
+            writer = csv.writer(out, lineterminator="\n")
+            writer.writerow(columns)
+            writer.writerows(rows)
+    except OSError as e:
+        error(f"Cannot write {output}", e)
+    finally:
+        if out not in [None, sys.stdout]:
+            out.close()
+
+
+def minutes(delta):
+    """Return a timedelta in whole minutes."""
+    return int(delta.total_seconds() // 60)
+
+
+class DayRecord:
+    """The work time of a single day. A day without an arrival is represented by a
+    record without data: hasData is false and all totals are None. If the entries of
+    the day don't form a valid sequence, problem describes why and hasData is false
+    as well."""
+
+    __slots__ = ("day", "currentlyHere", "workTime", "arrivedAt", "leftAt", "breakTime", "problem")
+
+    # names of the plain values of a day, as exported
+    COLUMNS = ["day", "arrived_at", "left_at", "work", "break", "present"]
+
+    def __init__(
+        self, day, currentlyHere=False, workTime=None, arrivedAt=None, leftAt=None, breakTime=None, problem=None
+    ):
+        self.day = day
+        self.currentlyHere = currentlyHere
+        self.workTime = workTime
+        self.arrivedAt = arrivedAt
+        self.leftAt = leftAt
+        self.breakTime = breakTime
+        self.problem = problem
+
+    @property
+    def hasData(self):
+        return self.arrivedAt is not None and self.problem is None
+
+    def values(self):
+        """Return the day as plain values in the order of COLUMNS, with the times in ISO
+        format and the totals in minutes. The totals of a day without data are None."""
+        if not self.hasData:
+            return self.day.isoformat(), None, None, None, None, False
+        return (
+            self.day.isoformat(),
+            adapt_datetime_iso(self.arrivedAt),
+            adapt_datetime_iso(self.leftAt),
+            minutes(self.workTime),
+            minutes(self.breakTime),
+            self.currentlyHere,
+        )
+
+    def __repr__(self):
+        if self.problem is not None:
+            return f"DayRecord({self.day}, problem={self.problem!r})"
+        if self.arrivedAt is None:
+            return f"DayRecord({self.day}, no data)"
+        return (
+            f"DayRecord({self.day}, currentlyHere={self.currentlyHere}, workTime={self.workTime},"
+            f" arrivedAt={self.arrivedAt}, leftAt={self.leftAt}, breakTime={self.breakTime})"
+        )
 
-    # Use the end of the day as endtime
-    endTime = datetime.combine(d + timedelta(days=1), time())
 
-    # Get all entries between the start time, and the end time (if applicable)
+def getEntries(con, d):
+    """Return the entries of a day as a list of (type, ts), starting at its first
+    arrival and including an entry at midnight of the following day. The list is
+    empty if there is no arrival on that day."""
+    nextDay = datetime.combine(d + timedelta(days=1), time())
     cur = con.execute(
-        "SELECT type, ts FROM times WHERE ts >= ? AND ts <= ? ORDER BY ts ASC",
-        (startTime, endTime),
+        "SELECT type, ts FROM times WHERE user = ? AND project = ? AND ts >= ? AND ts <= ? ORDER BY ts ASC",
+        (con.user, con.project, con.adaptTs(datetime.combine(d, time())), con.adaptTs(nextDay)),
     )
-    return cur
+    entries = []
+    for type, ts in cur:
+        if entries or (type == ACT_ARRIVE and ts < nextDay):
+            entries.append((type, ts))
+    return entries
 
 
-def getWorkTimeForDay(con, d=date.today()):
+def summarizeEntries(day, entries, now=None):
+    """Run the arrive/break/resume/leave state machine over the entries of a single
+    day, starting at the day's first arrival. Returns a DayRecord, which has no data
+    if there is no arrival and carries a problem if the sequence of entries is broken."""
     summaryTime = timedelta(0)
     arrival = None
     arrivedAt = None
     breakTime = timedelta(0)
     breakEnd = None
-    leftAt = datetime.now()
-    for type, ts in getEntries(con, d):
+    leftAt = now
+    for type, ts in entries:
+        if not arrivedAt and type != ACT_ARRIVE:
+            # skip anything before the first arrival, e.g. the tail of the previous day
+            continue
         if not arrival:
             if type not in [ACT_ARRIVE, ACT_RESUME]:
-                error(f"Expected arrival while computing presence time, got {type} at {ts}", None)
+                return DayRecord(
+                    day,
+                    arrivedAt=arrivedAt,
+                    problem=f"Expected arrival while computing presence time, got {type} at {ts}",
+                )
             arrival = ts
             if not arrivedAt:
                 arrivedAt = ts
@@ -419,208 +1471,747 @@ def getWorkTimeForDay(con, d=date.today()):
                 breakEnd = None
         else:
             if type not in [ACT_BREAK, ACT_LEAVE]:
-                error(f"Expected break/leave while computing presence time, got {type} at {ts}", None)
+                return DayRecord(
+                    day,
+                    arrivedAt=arrivedAt,
+                    problem=f"Expected break/leave while computing presence time, got {type} at {ts}",
+                )
             summaryTime += ts - arrival
             arrival = None
             leftAt = breakEnd = ts
+    if not arrivedAt:
+        return DayRecord(day)
     if arrival:
-        leftAt = datetime.now()
+        leftAt = now or datetime.now()
     arrivedAt = arrivedAt.replace(second=0, microsecond=0)
     leftAt = leftAt.replace(second=0, microsecond=0)
     breakTime = timedelta(minutes=breakTime.total_seconds() // 60)
     summaryTime = leftAt - arrivedAt - breakTime
-    return arrival is not None, summaryTime, arrivedAt, leftAt, breakTime
+    return DayRecord(day, arrival is not None, summaryTime, arrivedAt, leftAt, breakTime)
+
+
+def getDay(con, d):
+    """Return the DayRecord of a single day, computed from its entries."""
+    return summarizeEntries(d, getEntries(con, d), datetime.now())
+
+
+def groupEntriesByDay(rows):
+    """Group an ordered stream of (type, ts) rows into (day, entries) pairs. An entry at
+    exactly midnight is also handed to the previous day, mirroring getEntries()."""
+    day, entries = None, []
+    for type, ts in rows:
+        if ts.date() != day:
+            if entries:
+                if ts.time() == time():
+                    entries.append((type, ts))
+                yield day, entries
+            day, entries = ts.date(), []
+        entries.append((type, ts))
+    if entries:
+        yield day, entries
+
+
+def iterWorkTime(con, start, end):
+    """Compute the work time for every day in [start, end) with a single ordered scan
+    over the times table. Yields a DayRecord for each day that has an arrival, in
+    chronological order; days without an arrival or with an inconsistent sequence of
+    entries are skipped."""
+    now = datetime.now()
+    cur = con.execute(
+        "SELECT type, ts FROM times WHERE user = ? AND project = ? AND ts >= ? AND ts <= ? ORDER BY ts ASC",
+        (
+            con.user,
+            con.project,
+            con.adaptTs(datetime.combine(start, time())),
+            con.adaptTs(datetime.combine(end, time())),
+        ),
+    )
+    for day, entries in groupEntriesByDay(cur):
+        if day >= end:
+            break
+        record = summarizeEntries(day, entries, now)
+        if record.hasData:
+            yield record
+
+
+def summaryRow(con, record):
+    """Convert a DayRecord as yielded by iterWorkTime() into a daily_summary row. The
+    totals of days that are still open depend on the current time and are left empty."""
+    if record.currentlyHere:
+        return con.user, con.project, record.day, con.adaptTs(record.arrivedAt), None, None, None
+    return (
+        con.user,
+        con.project,
+        record.day,
+        con.adaptTs(record.arrivedAt),
+        con.adaptTs(record.leftAt),
+        int(record.workTime.total_seconds() // 60),
+        int(record.breakTime.total_seconds() // 60),
+    )
 
 
-def dayStatistics(con, offset=0):
-    headerPrinted = False
-    targetDay = date.today() + timedelta(days=offset)
+def fillCalendar(con, first, last):
+    """Fill the calendar of the current timeline with the default schedule for every
+    year from first to last without any days yet: DAY_HOURS on workdays, nothing on
+    weekends. Years are always filled as a whole, so January 1st tells if one is."""
+    for year in range(first, last + 1):
+        start = date(year, 1, 1)
+        if con.execute(
+            "SELECT 1 FROM calendar WHERE user = ? AND project = ? AND day = ?", (con.user, con.project, start)
+        ).fetchone():
+            continue
+        con.execute(
+            """
+                WITH RECURSIVE days (day) AS (
+                    SELECT ? UNION ALL SELECT date(day, '+1 day') FROM days WHERE day < ?
+                )
+                INSERT INTO calendar (user, project, day, expected, kind)
+                SELECT ?, ?, day,
+                    CASE WHEN strftime('%w', day) IN ('0', '6') THEN 0 ELSE ? END,
+                    CASE WHEN strftime('%w', day) IN ('0', '6') THEN 'weekend' ELSE 'workday' END
+                FROM days
+            """,
+            (start, date(year, 12, 31), con.user, con.project, CALENDAR_KINDS["workday"]),
+        )
+
+
+def ledgerTotals(con, day):
+    """Return the running totals of the work and the expected minutes of the current
+    timeline up to and including day, as far as the ledger has them."""
+    row = con.execute(
+        """
+            SELECT work_total, expected_total FROM ledger
+            WHERE user = ? AND project = ? AND day <= ? ORDER BY day DESC LIMIT 1
+        """,
+        (con.user, con.project, day),
+    ).fetchone()
+    return tuple(row) if row is not None else (0, 0)
+
+
+def getLedgerEnd(con):
+    """Return the last day in the ledger of the current timeline, or None."""
+    row = con.execute(
+        "SELECT day FROM ledger WHERE user = ? AND project = ? ORDER BY day DESC LIMIT 1", (con.user, con.project)
+    ).fetchone()
+    return row[0] if row is not None else None
+
+
+def updateLedger(con, start):
+    """Repair the ledger of the current timeline after the summaries or the calendar
+    of the days from start on changed. The ledger runs from the first day with entries
+    until the last closed day; its rows from start on, or from its end on if that is
+    earlier, are recomputed in one statement. Must be called within the transaction
+    that made the change."""
+    row = con.execute(
+        """
+            SELECT day FROM daily_summary
+            WHERE user = ? AND project = ? AND left_at IS NOT NULL ORDER BY day DESC LIMIT 1
+        """,
+        (con.user, con.project),
+    ).fetchone()
+    last = getLedgerEnd(con)
+    if row is None:
+        if last is not None:
+            con.execute("DELETE FROM ledger WHERE user = ? AND project = ?", (con.user, con.project))
+        return
+    end = row[0]
+    if last is not None and start > last and end <= last:
+        # neither a day in the ledger changed nor was a later one closed
+        return
+    first = con.execute(
+        "SELECT day FROM daily_summary WHERE user = ? AND project = ? ORDER BY day LIMIT 1", (con.user, con.project)
+    ).fetchone()[0]
+    if last is not None:
+        start = min(start, last + timedelta(days=1))
+    start = max(start, first)
+    con.execute("DELETE FROM ledger WHERE user = ? AND project = ? AND day >= ?", (con.user, con.project, start))
+    if end < start:
+        return
+    work, expected = ledgerTotals(con, start - timedelta(days=1))
+    fillCalendar(con, start.year, end.year)
+    con.execute(
+        """
+            INSERT INTO ledger (user, project, day, work_total, expected_total)
+            SELECT c.user, c.project, c.day,
+                :work + SUM(COALESCE(s.work, 0)) OVER (ORDER BY c.day),
+                :expected + SUM(c.expected) OVER (ORDER BY c.day)
+            FROM calendar AS c
+            LEFT JOIN daily_summary AS s
+                ON s.user = c.user AND s.project = c.project AND s.day = c.day AND s.left_at IS NOT NULL
+            WHERE c.user = :user AND c.project = :project AND c.day >= :start AND c.day <= :end
+        """,
+        {"user": con.user, "project": con.project, "start": start, "end": end, "work": work, "expected": expected},
+    )
+
+
+def storeDailySummary(con, start, end):
+    """Recompute the daily_summary rows of all days in [start, end) from their entries.
+    Returns the number of days stored."""
+    con.execute(
+        "DELETE FROM daily_summary WHERE user = ? AND project = ? AND day >= ? AND day < ?",
+        (con.user, con.project, start, end),
+    )
+    cur = con.executemany(
+        """
+            INSERT INTO daily_summary (user, project, day, arrived_at, left_at, work, pause)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        (summaryRow(con, record) for record in iterWorkTime(con, start, end)),
+    )
+    return cur.rowcount
+
+
+def refreshDailySummary(con, start, end):
+    """Recompute the daily_summary rows of all days in [start, end) from their entries,
+    making sure the calendar covers them, and repair the ledger. Returns the number of
+    days stored. Must be called within the transaction that modified the entries."""
+    fillCalendar(con, start.year, (end - timedelta(days=1)).year)
+    days = storeDailySummary(con, start, end)
+    updateLedger(con, start)
+    return days
+
+
+def updateDailySummary(con, day):
+    refreshDailySummary(con, day, day + timedelta(days=1))
+
+
+def rebuildDailySummary(con):
+    """Recompute the whole daily_summary table of all users and projects from the
+    entries, along with the ledger. Returns the number of days stored. Must be called
+    within a transaction."""
+    con.execute("DELETE FROM daily_summary")
+    con.execute("DELETE FROM ledger")
+    days = 0
+    for user, project in con.execute("SELECT DISTINCT user, project FROM times").fetchall():
+        with con.timeline(user, project):
+            firstTime, lastTime = getFirstTime(con), getLastTime(con)
+            days += refreshDailySummary(con, firstTime.date(), lastTime.date() + timedelta(days=1))
+    return days
+
+
+def rebuildSummary(con):
+    """Backfill the per-day summaries from the recorded entries."""
+    start = perf_counter()
+    con.execute("BEGIN EXCLUSIVE")
+    try:
+        days = rebuildDailySummary(con)
+        con.execute("UPDATE data_version SET version = version + 1")
+        con.execute("DELETE FROM report_cache")
+        con.commit()
+    except sqlite3.Error as e:
+        con.rollback()
+        error("Rebuilding the daily summary failed", e)
+    message(f"Rebuilt the summary of {days} days in {perf_counter() - start:.3f} s")
+
+
+def iterDailySummary(con, start, end):
+    """Like iterWorkTime(), but read the totals of closed days from the daily_summary
+    table and only compute days that are still open from their entries."""
+
+    def query():
+        return con.execute(
+            """
+                SELECT day, arrived_at, left_at, work, pause FROM daily_summary
+                WHERE user = ? AND project = ? AND day >= ? AND day < ? ORDER BY day
+            """,
+            (con.user, con.project, start, end),
+        )
+
+    # only memoized rows need to be held in memory, otherwise they are streamed
+    rows = query() if con.memo is None else con.cached(("daily_summary", start, end), lambda: query().fetchall())
+    for day, arrivedAt, leftAt, work, pause in rows:
+        if leftAt is None:
+            yield from iterWorkTime(con, day, day + timedelta(days=1))
+        else:
+            yield DayRecord(day, False, timedelta(minutes=work), arrivedAt, leftAt, timedelta(minutes=pause))
+
+
+def iterDays(con, start, end):
+    """Yield a DayRecord for every calendar day in [start, end), including days
+    without data, e.g. weekends, holidays and sick days."""
+    workDays = {record.day: record for record in iterDailySummary(con, start, end)}
+    day = start
+    while day < end:
+        yield workDays.get(day) or DayRecord(day)
+        day += timedelta(days=1)
+
+
+def calendarDays(con, start, end):
+    """Return the expected minutes and the kind of every day in [start, end) of the
+    current timeline, as a dict by day. Years missing from the calendar are filled
+    first, unless the database is read-only or busy."""
+    try:
+        with con.savepoint("calendar"):
+            fillCalendar(con, start.year, (end - timedelta(days=1)).year)
+    except sqlite3.OperationalError:
+        pass
+    rows = con.execute(
+        "SELECT day, expected, kind FROM calendar WHERE user = ? AND project = ? AND day >= ? AND day < ?",
+        (con.user, con.project, start, end),
+    )
+    return {day: (expected, kind) for day, expected, kind in rows}
+
+
+def expectedMinutes(con, start, end, today=None):
+    """Return the work minutes the calendar expects of the current timeline in
+    [start, end). Only days from its first day with entries on count, and of those
+    only the days before today, or today once it has entries. Days without entries
+    count as well, so absence shows while vacations and holidays don't."""
+    today = today or date.today()
+    return con.execute(
+        """
+            SELECT COALESCE(SUM(expected), 0) FROM calendar
+            WHERE user = :user AND project = :project AND day >= :start AND day < :end
+                AND day >= (SELECT MIN(day) FROM daily_summary WHERE user = :user AND project = :project)
+                AND (day < :today OR day = :today AND EXISTS (
+                    SELECT 1 FROM daily_summary WHERE user = :user AND project = :project AND day = :today
+                ))
+        """,
+        {"user": con.user, "project": con.project, "start": start, "end": end, "today": today},
+    ).fetchone()[0]
+
+
+class DayReport:
+    """The entries of a day from its first arrival on, their DayRecord and, if the
+    day has data, a good time to leave."""
+
+    __slots__ = ("record", "entries", "leaveAt")
+
+    def __init__(self, record, entries, leaveAt=None):
+        self.record = record
+        self.entries = entries
+        self.leaveAt = leaveAt
+
+    def plain(self):
+        return {
+            **dict(zip(DayRecord.COLUMNS, self.record.values())),
+            "problem": self.record.problem,
+            "leave_at": adapt_datetime_iso(self.leaveAt) if self.leaveAt is not None else None,
+            "entries": [{"type": type, "ts": adapt_datetime_iso(ts)} for type, ts in self.entries],
+        }
+
+    def table(self):
+        return ["type", "ts"], [(type, adapt_datetime_iso(ts)) for type, ts in self.entries]
+
+
+def computeDay(con, offset=0):
+    day = date.today() + timedelta(days=offset)
+    entries = getEntries(con, day)
+    now = datetime.now()
+    record = summarizeEntries(day, entries, now)
+    if not record.hasData:
+        return DayReport(record, entries)
+    return DayReport(record, entries, now + timedelta(minutes=expectedOnDay(con, day)) - record.workTime)
+
+
+def expectedOnDay(con, day):
+    """Return the minutes the calendar expects to be worked on day."""
+    return calendarDays(con, day, day + timedelta(days=1)).get(day, (0, None))[0]
+
+
+def textDay(report):
+    lines = []
     totalBreak, extraMsg = None, ""
-    for type, ts in getEntries(con, targetDay):
-        if not headerPrinted:
-            message("Time tracking entries for {:%d.%m.%Y}:".format(targetDay))
-            headerPrinted = True
+    if report.entries:
+        lines.append("Time tracking entries for {:%d.%m.%Y}:".format(report.record.day))
+    for type, ts in report.entries:
         if type == ACT_BREAK:
             totalBreak = ts
         elif type == ACT_RESUME and totalBreak is not None:
             extraMsg = " ({})".format(str(ts - totalBreak).split(".")[0])
             totalBreak = None
-        message("  {:<10} {:%d.%m.%Y %H:%M}{}".format(type, ts, extraMsg))
+        lines.append("  {:<10} {:%d.%m.%Y %H:%M}{}".format(type, ts, extraMsg))
         extraMsg = ""
 
-    currentlyHere, totalTime, *_ = getWorkTimeForDay(con)
-    if currentlyHere:
-        message("You are currently at work.")
-    message(
-        "You have worked {} h {} min".format(
-            int(totalTime.total_seconds() // (60 * 60)), int((totalTime.total_seconds() % 3600) // 60)
+    record = report.record
+    if record.hasData:
+        totalTime = record.workTime
+        if record.currentlyHere:
+            lines.append("You are currently at work.")
+        lines.append(
+            "You have worked {} h {} min".format(
+                int(totalTime.total_seconds() // (60 * 60)), int((totalTime.total_seconds() % 3600) // 60)
+            )
         )
-    )
-    time_left = timedelta(hours=DAY_HOURS) - totalTime
-    leave_time = datetime.now() + time_left
-    message("A good time to leave would be at {}".format((leave_time).strftime("%H:%M")))
-
+        lines.append("A good time to leave would be at {}".format(report.leaveAt.strftime("%H:%M")))
+    return lines
+
+
+def dayStatistics(con, offset=0, format="text", watch=False, interval=1.0):
+    if watch:
+        if format != "text":
+            error("Only the text format can be watched", None)
+        return watchDay(con, offset, interval)
+    report = computeDay(con, offset)
+    if format == "text" and not report.entries:
+        error("There is no arrival on {:%d.%m.%Y}".format(report.record.day), None)
+    writeReport(report, format)
+    if format == "text" and report.record.problem is not None:
+        error(report.record.problem, None)
+
+
+def watchDay(con, offset=0, interval=1.0):
+    """Keep the statistics of a day on the terminal until interrupted. The entries
+    and the expected minutes of the day are only queried again once another
+    connection changed the database, which PRAGMA data_version tells without
+    reading any pages, or the day turned over. In between the time worked so far
+    and the good time to leave only advance with the clock, and the screen is only
+    redrawn when its text changes, which is once a minute while at work."""
+    from time import sleep
+
+    out = sys.stdout
+    redraw = out.isatty()
+    day = version = entries = expected = None
+    lines = []
+    try:
+        while True:
+            now = datetime.now()
+            current = now.date() + timedelta(days=offset)
+            changed = con.execute("PRAGMA data_version").fetchone()[0]
+            if changed != version or current != day:
+                version, day = changed, current
+                entries = getEntries(con, day)
+                expected = expectedOnDay(con, day)
+            record = summarizeEntries(day, entries, now)
+            if record.hasData:
+                report = DayReport(record, entries, now + timedelta(minutes=expected) - record.workTime)
+            else:
+                report = DayReport(record, entries)
+            text = textDay(report) if entries else ["There is no arrival on {:%d.%m.%Y}".format(day)]
+            if record.problem is not None:
+                text.append(record.problem)
+            if text != lines:
+                if redraw and lines:
+                    # back to the first line of the previous drawing, clearing everything below
+                    out.write("\x1b[{:d}F\x1b[J".format(len(lines)))
+                out.write("".join(line + "\n" for line in text))
+                out.flush()
+                lines = text
+            sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+
+def statusFields(type, ts, day, worked, now):
+    """Return the fields of the status format for the latest entry of the given type
+    and time, which belongs to the work day day with the time worked until then."""
+    # entries punched with an offset into the future count from their time on
+    duration = max(now - ts, timedelta(0)) if ts is not None else timedelta(0)
+    if type in [ACT_ARRIVE, ACT_RESUME]:
+        worked += duration
+    elif type in [None, ACT_LEAVE] and day != now.date():
+        # a new day has begun without an arrival yet
+        worked = timedelta(0)
+    return {
+        "state": STATUS_STATES[type],
+        "type": type or "",
+        "since": ts,
+        "duration": "{:d}:{:02d}".format(*divmod(minutes(duration), 60)),
+        "duration_minutes": minutes(duration),
+        "worked": "{:d}:{:02d}".format(*divmod(minutes(worked), 60)),
+        "worked_minutes": minutes(worked),
+    }
 
-def monthStatistics(con, offset=0):
-    today = date.today()
-    startOfMonth = (today + timedelta(weeks=4 * offset)).replace(day=1)
-    message(startOfMonth.strftime("Statistics for %B %Y"))
 
-    current = startOfMonth
-    dailyHours = timedelta(hours=float(WEEK_HOURS) / 5.0)
-    monthTotal = timedelta(seconds=0)
-    extraHours = timedelta(seconds=0)
-    daysSoFar = 0
+def showStatus(con, db=DB_PATH, user="", project="", format=STATUS_FORMAT, busy_timeout=BUSY_TIMEOUT):
+    """Print whether you are working, on a break or gone and for how long, for shell
+    prompts. The status is read from the snapshot the punches keep next to the
+    database, which is only opened if the snapshot is missing or stale."""
+    snapshot = loadStatus(statusPath(db), user, project)
+    if snapshot is None:
+        con = dbSetup(busyTimeout=busy_timeout, path=db, user=user, project=project)
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            snapshot = statusSnapshot(con)
+            storeStatus(con, snapshot)
+            con.commit()
+        except sqlite3.OperationalError:
+            # a read-only or busy database still tells, it just doesn't get a snapshot
+            con.rollback()
+            snapshot = statusSnapshot(con)
+        finally:
+            con.close()
+        snapshot = parseStatus(snapshot)
+    try:
+        message(format.format(**statusFields(*snapshot, datetime.now())))
+    except (KeyError, IndexError, ValueError, TypeError) as e:
+        error(f"Invalid status format {format!r}", e)
+
+
+PERIODS = ["day", "week", "month", "quarter", "year"]
+
+
+class Period:
+    """A range of days [start, end) of one of the PERIODS kinds or a custom one, with
+    a title for the report header and a short label for its total."""
+
+    __slots__ = ("kind", "start", "end", "title", "label")
+
+    def __init__(self, kind, start, end, title, label="Total"):
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.title = title
+        self.label = label
+
+    @classmethod
+    def of(cls, kind, offset=0, today=None):
+        """Return the day, ISO week, calendar month, quarter or year that is offset
+        periods of that kind away from the one containing today."""
+        today = today or date.today()
+        if kind == "day":
+            start = today + timedelta(days=offset)
+            return cls(kind, start, start + timedelta(days=1), f"{start:%d.%m.%Y}", f"{start:%d.%m.}")
+        if kind == "week":
+            start = today - timedelta(days=today.weekday()) + timedelta(weeks=offset)
+            week = start.isocalendar()[1]
+            return cls(kind, start, start + timedelta(weeks=1), f"week {week:>02d}", f"Week {week:>02d}")
+        if kind == "year":
+            start = date(today.year + offset, 1, 1)
+            return cls(kind, start, start.replace(year=start.year + 1), f"{start.year}", f"{start.year}")
+        # months and quarters, counted in months since year 0 so they never drift
+        length = 3 if kind == "quarter" else 1
+        months = today.year * 12 + (today.month - 1) // length * length + offset * length
+        year, month = divmod(months, 12)
+        start = date(year, month + 1, 1)
+        year, month = divmod(months + length, 12)
+        end = date(year, month + 1, 1)
+        if kind == "quarter":
+            quarter = (start.month - 1) // 3 + 1
+            return cls(kind, start, end, f"Q{quarter} {start.year}", f"Q{quarter}")
+        return cls(kind, start, end, f"{start:%B %Y}", f"{start:%B}")
+
+    @classmethod
+    def between(cls, first, last):
+        """Return the custom period from first until last, both inclusive."""
+        if last < first:
+            error(f"The period ends on {last:%d.%m.%Y}, before it starts on {first:%d.%m.%Y}", None)
+        return cls("custom", first, last + timedelta(days=1), f"{first:%d.%m.%Y} - {last:%d.%m.%Y}")
+
+
+class PeriodReport:
+    """The days of a period up to today, with the total work time of the days worked.
+    currentlyHere tells if the last day worked is still open. calendar holds the
+    expected minutes and the kind of every day of the whole period."""
+
+    __slots__ = ("period", "days", "calendar", "work", "daysWorked", "currentlyHere")
+
+    def __init__(self, period, days, calendar, work=timedelta(0), daysWorked=0, currentlyHere=False):
+        self.period = period
+        self.days = days
+        self.calendar = calendar
+        self.work = work
+        self.daysWorked = daysWorked
+        self.currentlyHere = currentlyHere
+
+    def plain(self):
+        return {
+            "period": self.period.kind,
+            "title": self.period.title,
+            "start": self.period.start.isoformat(),
+            "end": (self.period.end - timedelta(days=1)).isoformat(),
+            "work": minutes(self.work),
+            "expected": sum(expected for expected, _ in self.calendar.values()),
+            "days_worked": self.daysWorked,
+            "present": self.currentlyHere,
+            "days": [
+                {
+                    **dict(zip(DayRecord.COLUMNS, record.values())),
+                    **dict(zip(["expected", "kind"], self.calendar.get(record.day, (0, None)))),
+                }
+                for record in self.days
+            ],
+        }
+
+    def table(self):
+        return DayRecord.COLUMNS, [record.values() for record in self.days]
+
+
+def computePeriod(con, period):
+    """Compute the work time of every day of a period up to today. All days come from
+    a single pass over the daily summaries, so long periods are as cheap per day as
+    short ones."""
+    # don't list days that are yet to come
+    end = min(date.today() + timedelta(days=1), period.end)
+    report = PeriodReport(period, list(iterDays(con, period.start, end)), calendarDays(con, period.start, period.end))
+    for record in report.days:
+        if record.hasData:
+            report.work += record.workTime
+            report.daysWorked += 1
+            report.currentlyHere = record.currentlyHere
+    return report
+
+
+def textPeriod(report):
+    """Render the days of a period, with the total and the expectation of the whole
+    period."""
+    period = report.period
+    lines = [f"Statistics for {period.title}:"]
+
+    daysSoFar = report.daysWorked
+    workdays = sum(1 for expected, _ in report.calendar.values() if expected > 0)
+    # expectation of the days worked so far
+    expectation = timedelta(0)
 
     headerPrinted = False
-    currentlyHere = False
-
-    while current.month == startOfMonth.month:
-        try:
-            currentlyHere, timeForDay, arrivedAt, leftAt, breakTime = getWorkTimeForDay(con, current)
-            daysSoFar += 1
+    for record in report.days:
+        current = record.day
+        expected, kind = report.calendar.get(current, (0, None))
+        if record.hasData:
+            timeForDay, breakTime = record.workTime, record.breakTime
             totalHours = int(timeForDay.total_seconds() // (60 * 60))
             totalMinutes = int((timeForDay.total_seconds() % 3600) // 60)
 
-            timedeltaForDay = timeForDay - dailyHours
+            expectation += timedelta(minutes=expected)
+            timedeltaForDay = timeForDay - timedelta(minutes=expected)
             timedeltaHours = timedeltaForDay.total_seconds() / (60 * 60)
 
-            monthTotal += timeForDay
-            extraHours += timedeltaForDay
-
             if not headerPrinted:
                 headerPrinted = True
-                message("   date        work  diff  arriv left  break")
-                message("   ----------  ----- ----- ----- ----- -----")
+                lines.append("   date        work  diff  arriv left  break")
+                lines.append("   ----------  ----- ----- ----- ----- -----")
             breakHours = int(breakTime.total_seconds() // (60 * 60))
             breakMinutes = int((breakTime.total_seconds() % 3600) // 60)
-            message(
+            lines.append(
                 f" * {current:%d.%m.%Y} {totalHours:>2d}h{totalMinutes:>02d}m {timedeltaHours:=+1.2f}"
-                f" {arrivedAt:%H:%M} {leftAt:%H:%M} {breakHours:02d}:{breakMinutes:02d}"
+                f" {record.arrivedAt:%H:%M} {record.leftAt:%H:%M} {breakHours:02d}:{breakMinutes:02d}"
             )
-        except ProgramAbortError:
-            if current.weekday() < 5:
-                # For non-weekend days, print a message
-                if not headerPrinted:
-                    headerPrinted = True
-                    message("   date        work  diff  arriv left  break")
-                    message("   ----------  ----- ----- ----- ----- -----")
-                message(f"  {current:%d.%m.%Y}    -              -")
-
-        current += timedelta(days=1)
-
-    weekTotalHours = int(monthTotal.total_seconds() // (60 * 60))
-    weekTotalMinutes = int((monthTotal.total_seconds() % 3600) // 60)
-    weekExtraHours = extraHours.total_seconds() / (60 * 60)
-    message("   ----------  ----- ----- ----- ----- -----")
-
-    if daysSoFar < 5:
-        # The week isn't over, compare your current state against the ideal rate
-        expectation = dailyHours * daysSoFar
+        elif expected > 0 or kind not in [None, "workday", "weekend"]:
+            # For days off and days expected to be worked, print a message
+            if not headerPrinted:
+                headerPrinted = True
+                lines.append("   date        work  diff  arriv left  break")
+                lines.append("   ----------  ----- ----- ----- ----- -----")
+            if expected > 0:
+                lines.append(f"  {current:%d.%m.%Y}    -              -")
+            else:
+                lines.append(f"  {current:%d.%m.%Y}    {kind}")
+
+    periodTotal = report.work
+    periodTotalHours = int(periodTotal.total_seconds() // (60 * 60))
+    periodTotalMinutes = int((periodTotal.total_seconds() % 3600) // 60)
+    periodExtraHours = (periodTotal - expectation).total_seconds() / (60 * 60)
+    lines.append("   ----------  ----- ----- ----- ----- -----")
+
+    if daysSoFar < workdays:
+        # The period isn't over, compare your current state against the ideal rate
         expectationHours = int(expectation.total_seconds() // (60 * 60))
         expectationMinutes = int((expectation.total_seconds() % 3600) // 60)
-        message("   Expected:   {:>2d} h {:>02d} min".format(expectationHours, expectationMinutes))
-    week_number = startOfMonth.isocalendar()[1]
-    message(
-        f"    Week {week_number:>02d}:   {weekTotalHours:>2d} h {weekTotalMinutes:>02d} min    {weekExtraHours:=+2.2f}"
-    )
-    if daysSoFar < 5 or (daysSoFar == 5 and currentlyHere):
+        lines.append("   Expected:   {:>2d} h {:>02d} min".format(expectationHours, expectationMinutes))
+    label = f"{period.label}:"
+    lines.append(f"{label:>12s}   {periodTotalHours:>2d} h {periodTotalMinutes:>02d} min    {periodExtraHours:=+2.2f}")
+    if daysSoFar < workdays or (daysSoFar == workdays and report.currentlyHere):
         # Calculate avg. remaining work time per day
-        totalExpectation = timedelta(hours=WEEK_HOURS)
-        remaining = totalExpectation - monthTotal
+        totalExpectation = timedelta(minutes=sum(expected for expected, _ in report.calendar.values()))
+        remaining = totalExpectation - periodTotal
         remainingHours = int(remaining.total_seconds() // (60 * 60))
         remainingMinutes = int((remaining.total_seconds() % 3600) // 60)
-        message("  ----------   -----------   ------")
-        message(f"  Remaining:   {remainingHours:>2d} h {remainingMinutes:>02d} min")
-        if daysSoFar < 4:
+        lines.append("  ----------   -----------   ------")
+        lines.append(f"  Remaining:   {remainingHours:>2d} h {remainingMinutes:>02d} min")
+        if daysSoFar < workdays - 1:
             # Remaining per day
-            remainingPerDay = remaining / (5 - daysSoFar)
+            remainingPerDay = remaining / (workdays - daysSoFar)
             remainingPerDayHours = int(remainingPerDay.total_seconds() // (60 * 60))
             remainingPerDayMinutes = int((remainingPerDay.total_seconds() % 3600) // 60)
-            message(f"      Daily:   {remainingPerDayHours:>2d} h {remainingPerDayMinutes:>02d} min")
+            lines.append(f"      Daily:   {remainingPerDayHours:>2d} h {remainingPerDayMinutes:>02d} min")
+    return lines
 
 
-def weekStatistics(con, offset=0):
-    today = date.today()
-    startOfWeek = today - timedelta(days=today.weekday()) + timedelta(weeks=offset)
-    endOfWeek = min(today + timedelta(days=1), startOfWeek + timedelta(weeks=1))
-    message("Statistics for week {:>02d}:".format(startOfWeek.isocalendar()[1]))
+def periodStatistics(con, period, format="text"):
+    writeReport(computePeriod(con, period), format)
 
-    current = startOfWeek
-    dailyHours = timedelta(hours=float(WEEK_HOURS) / 5.0)
-    weekTotal = timedelta(seconds=0)
-    extraHours = timedelta(seconds=0)
-    daysSoFar = 0
 
-    headerPrinted = False
-    currentlyHere = False
+def weekStatistics(con, offset=0, format="text"):
+    periodStatistics(con, Period.of("week", offset), format)
 
-    while current < endOfWeek:
-        try:
-            currentlyHere, timeForDay, arrivedAt, leftAt, breakTime = getWorkTimeForDay(con, current)
-            daysSoFar += 1
-            totalHours = int(timeForDay.total_seconds() // (60 * 60))
-            totalMinutes = int((timeForDay.total_seconds() % 3600) // 60)
 
-            timedeltaForDay = timeForDay - dailyHours
-            timedeltaHours = timedeltaForDay.total_seconds() / (60 * 60)
+def monthStatistics(con, offset=0, format="text"):
+    periodStatistics(con, Period.of("month", offset), format)
 
-            weekTotal += timeForDay
-            extraHours += timedeltaForDay
 
-            if not headerPrinted:
-                headerPrinted = True
-                message("   date        work  diff  arriv left  break")
-                message("   ----------  ----- ----- ----- ----- -----")
-            breakHours = int(breakTime.total_seconds() // (60 * 60))
-            breakMinutes = int((breakTime.total_seconds() % 3600) // 60)
-            message(
-                f" * {current:%d.%m.%Y} {totalHours:>2d}h{totalMinutes:>02d}m {timedeltaHours:=+1.2f}"
-                f" {arrivedAt:%H:%M} {leftAt:%H:%M} {breakHours:02d}:{breakMinutes:02d}"
+def quarterStatistics(con, offset=0, format="text"):
+    periodStatistics(con, Period.of("quarter", offset), format)
+
+
+def yearStatistics(con, offset=0, format="text"):
+    periodStatistics(con, Period.of("year", offset), format)
+
+
+def rangeStatistics(con, start, end=None, format="text"):
+    periodStatistics(con, Period.between(start, end or date.today()), format)
+
+
+def sumClosedDays(con, start, end):
+    """Return the work minutes of the closed days in [start, end), i.e. all days with
+    an arrival except those still open, and the minutes expected in that range."""
+    work = con.execute(
+        """
+            SELECT COALESCE(SUM(work), 0) FROM daily_summary
+            WHERE user = ? AND project = ? AND day >= ? AND day < ? AND left_at IS NOT NULL
+        """,
+        (con.user, con.project, start, end),
+    ).fetchone()[0]
+    return work, expectedMinutes(con, start, end)
+
+
+def cachedClosedDays(con, start, end):
+    """Like sumClosedDays(), but look the totals up in the report cache first and store
+    them there if they are missing or were computed for an older data version."""
+    cached = con.execute(
+        """
+            SELECT c.work, c.expected FROM report_cache AS c
+            LEFT JOIN data_version AS v ON v.user = c.user AND v.project = c.project
+            WHERE c.user = ? AND c.project = ? AND c.start = ? AND c.end = ? AND c.version = COALESCE(v.version, 0)
+        """,
+        (con.user, con.project, start, end),
+    ).fetchone()
+    if cached is not None:
+        return tuple(cached)
+    work, expected = sumClosedDays(con, start, end)
+    try:
+        with con.savepoint("report_cache"):
+            # drop the totals of older data versions along the way
+            con.execute(
+                """
+                    DELETE FROM report_cache WHERE user = ? AND project = ? AND version != (
+                        SELECT COALESCE(MAX(version), 0) FROM data_version WHERE user = ? AND project = ?
+                    )
+                """,
+                (con.user, con.project, con.user, con.project),
             )
-        except ProgramAbortError:
-            if current.weekday() < 5:
-                # For non-weekend days, print a message
-                if not headerPrinted:
-                    headerPrinted = True
-                    message("   date        work  diff  arriv left  break")
-                    message("   ----------  ----- ----- ----- ----- -----")
-                message(f"  {current:%d.%m.%Y}    -              -")
-
-        current += timedelta(days=1)
-
-    weekTotalHours = int(weekTotal.total_seconds() // (60 * 60))
-    weekTotalMinutes = int((weekTotal.total_seconds() % 3600) // 60)
-    weekExtraHours = extraHours.total_seconds() / (60 * 60)
-    message("   ----------  ----- ----- ----- ----- -----")
-
-    if daysSoFar < 5:
-        # The week isn't over, compare your current state against the ideal rate
-        expectation = dailyHours * daysSoFar
-        expectationHours = int(expectation.total_seconds() // (60 * 60))
-        expectationMinutes = int((expectation.total_seconds() % 3600) // 60)
-        message("   Expected:   {:>2d} h {:>02d} min".format(expectationHours, expectationMinutes))
-    week_number = startOfWeek.isocalendar()[1]
-    message(
-        f"    Week {week_number:>02d}:   {weekTotalHours:>2d} h {weekTotalMinutes:>02d} min    {weekExtraHours:=+2.2f}"
-    )
-    if daysSoFar < 5 or (daysSoFar == 5 and currentlyHere):
-        # Calculate avg. remaining work time per day
-        totalExpectation = timedelta(hours=WEEK_HOURS)
-        remaining = totalExpectation - weekTotal
-        remainingHours = int(remaining.total_seconds() // (60 * 60))
-        remainingMinutes = int((remaining.total_seconds() % 3600) // 60)
-        message("  ----------   -----------   ------")
-        message(f"  Remaining:   {remainingHours:>2d} h {remainingMinutes:>02d} min")
-        if daysSoFar < 4:
-            # Remaining per day
-            remainingPerDay = remaining / (5 - daysSoFar)
-            remainingPerDayHours = int(remainingPerDay.total_seconds() // (60 * 60))
-            remainingPerDayMinutes = int((remainingPerDay.total_seconds() % 3600) // 60)
-            message(f"      Daily:   {remainingPerDayHours:>2d} h {remainingPerDayMinutes:>02d} min")
+            con.execute(
+                """
+                    INSERT OR REPLACE INTO report_cache (user, project, start, end, version, work, expected)
+                    SELECT ?, ?, ?, ?, COALESCE(MAX(version), 0), ?, ? FROM data_version WHERE user = ? AND project = ?
+                """,
+                (con.user, con.project, start, end, work, expected, con.user, con.project),
+            )
+    except sqlite3.OperationalError:
+        # the database is read-only or busy, the totals just don't get cached then
+        pass
+    return work, expected
 
 
-def overallStatistics(con, weeks):
+class SummaryReport:
+    """The total and the expected work time from start until today."""
+
+    __slots__ = ("start", "total", "expected")
+
+    def __init__(self, start, total, expected):
+        self.start = start
+        self.total = total
+        self.expected = expected
+
+    def plain(self):
+        return {"start": self.start.isoformat(), "work": minutes(self.total), "expected": minutes(self.expected)}
+
+    def table(self):
+        return ["start", "work", "expected"], [(self.start.isoformat(), minutes(self.total), minutes(self.expected))]
+
+
+def computeSummary(con, weeks=None):
+    """Compute the total and the expected work time of the given number of weeks
+    before the current one up to today, or of all weeks with entries."""
     today = date.today()
     if weeks is None:
         # by default, show all info we have
@@ -630,24 +2221,34 @@ def overallStatistics(con, weeks):
         else:
             # if there is no entry yet, default to showing the entire current year
             weeks = today.isocalendar()[1]
-    startOfPeriod = today - timedelta(days=today.weekday()) - timedelta(weeks=weeks)
+    startOfWeek = today - timedelta(days=today.weekday())
+    startOfPeriod = startOfWeek - timedelta(weeks=weeks)
     endOfPeriod = today
 
-    current = startOfPeriod
-    dailyHours = timedelta(hours=float(WEEK_HOURS) / 5.0)
     total = timedelta(seconds=0)
     expected = timedelta(seconds=0)
 
-    while current <= endOfPeriod:
-        try:
-            _, timeForDay, *_ = getWorkTimeForDay(con, current)
-            total += timeForDay
-            if current.weekday() < 5:  # Not working normally on Saturday and Sunday
-                expected += dailyHours
-        except ProgramAbortError:
-            pass  # ignore days where I didn't work (either sick or holiday)
-        current += timedelta(days=1)
-
+    # The weeks before the current one rarely change, so their totals are cached.
+    # The current week and days still open are always computed.
+    for closedMinutes, closedExpected in [
+        cachedClosedDays(con, startOfPeriod, startOfWeek),
+        sumClosedDays(con, startOfWeek, endOfPeriod + timedelta(days=1)),
+    ]:
+        total += timedelta(minutes=closedMinutes)
+        expected += timedelta(minutes=closedExpected)
+
+    openDays = con.execute(
+        "SELECT day FROM daily_summary WHERE user = ? AND project = ? AND day >= ? AND day <= ? AND left_at IS NULL",
+        (con.user, con.project, startOfPeriod, endOfPeriod),
+    ).fetchall()
+    for (openDay,) in openDays:
+        for record in iterWorkTime(con, openDay, openDay + timedelta(days=1)):
+            total += record.workTime
+    return SummaryReport(startOfPeriod, total, expected)
+
+
+def totalLines(total, expected):
+    """Render the expected and the total work time and their difference."""
     diff = total - expected
     expectedHours = int(expected.total_seconds() // (60 * 60))
     expectedMinutes = int((expected.total_seconds() % (60 * 60)) // 60)
@@ -657,14 +2258,831 @@ def overallStatistics(con, weeks):
     diffHours = int(abs(diff.total_seconds()) // (60 * 60))
     diffMinutes = int((abs(diff.total_seconds()) % (60 * 60)) // 60)
     diffHoursStr = f"{'-' if diffNegative else '+'}{diffHours:d}"
-    message(f"Statistics from {startOfPeriod.isoformat()} until today:")
-    message(f"Expected: {expectedHours:>4d} h {expectedMinutes:>02d} min")
-    message(f"   Total: {totalHours:>4d} h {totalMinutes:>02d} min")
-    message(f"    Diff: {diffHoursStr:>4s} h {diffMinutes:>02d} min")
+    return [
+        f"Expected: {expectedHours:>4d} h {expectedMinutes:>02d} min",
+        f"   Total: {totalHours:>4d} h {totalMinutes:>02d} min",
+        f"    Diff: {diffHoursStr:>4s} h {diffMinutes:>02d} min",
+    ]
+
+
+def textSummary(report):
+    return [f"Statistics from {report.start.isoformat()} until today:", *totalLines(report.total, report.expected)]
+
+
+def overallStatistics(con, weeks, format="text"):
+    writeReport(computeSummary(con, weeks), format)
+
+
+class BalanceReport:
+    """The total and the expected work time of the days from start until end, both
+    inclusive."""
+
+    __slots__ = ("start", "end", "total", "expected")
+
+    def __init__(self, start, end, total, expected):
+        self.start = start
+        self.end = end
+        self.total = total
+        self.expected = expected
+
+    def plain(self):
+        return {
+            "start": self.start.isoformat(),
+            "end": self.end.isoformat(),
+            "work": minutes(self.total),
+            "expected": minutes(self.expected),
+            "balance": minutes(self.total - self.expected),
+        }
+
+    def table(self):
+        return ["start", "end", "work", "expected", "balance"], [
+            (
+                self.start.isoformat(),
+                self.end.isoformat(),
+                minutes(self.total),
+                minutes(self.expected),
+                minutes(self.total - self.expected),
+            )
+        ]
 
 
-def main():
+def computeBalance(con, start=None, end=None):
+    """Compute the work time and the expectation from start until end, both inclusive,
+    by default from the first day with entries until today. The days in the ledger
+    take two lookups, only the days after the last closed one are summed up, with days
+    still open computed from their entries."""
+    today = date.today()
+    if start is None:
+        firstEntry = getFirstTime(con)
+        start = firstEntry.date() if firstEntry is not None else today
+    end = end or today
+    if end < start:
+        error(f"The range ends on {end:%d.%m.%Y}, before it starts on {start:%d.%m.%Y}", None)
+
+    work = expected = 0
+    last = getLedgerEnd(con)
+    if last is not None and last >= start:
+        workBefore, expectedBefore = ledgerTotals(con, start - timedelta(days=1))
+        workUntil, expectedUntil = ledgerTotals(con, min(end, last))
+        work, expected = workUntil - workBefore, expectedUntil - expectedBefore
+
+    rest = max(start, last + timedelta(days=1)) if last is not None else start
+    total = timedelta(0)
+    if rest <= end:
+        restWork, restExpected = sumClosedDays(con, rest, end + timedelta(days=1))
+        work += restWork
+        expected += restExpected
+        openDays = con.execute(
+            """
+                SELECT day FROM daily_summary
+                WHERE user = ? AND project = ? AND day >= ? AND day <= ? AND left_at IS NULL
+            """,
+            (con.user, con.project, rest, end),
+        ).fetchall()
+        for (openDay,) in openDays:
+            for record in iterWorkTime(con, openDay, openDay + timedelta(days=1)):
+                total += record.workTime
+    return BalanceReport(start, end, total + timedelta(minutes=work), timedelta(minutes=expected))
+
+
+def textBalance(report):
+    return [
+        f"Balance from {report.start:%d.%m.%Y} until {report.end:%d.%m.%Y}:",
+        *totalLines(report.total, report.expected),
+    ]
+
+
+def balanceStatistics(con, start=None, end=None, format="text"):
+    writeReport(computeBalance(con, start, end), format)
+
+
+class TeamReport:
+    """The total and the expected work time of every user of a project in a week."""
+
+    __slots__ = ("project", "period", "totals")
+
+    def __init__(self, project, period, totals):
+        self.project = project
+        self.period = period
+        self.totals = totals
+
+    def plain(self):
+        return {
+            "project": self.project,
+            "title": self.period.title,
+            "start": self.period.start.isoformat(),
+            "end": (self.period.end - timedelta(days=1)).isoformat(),
+            "users": [
+                {"user": user, "work": minutes(total), "expected": minutes(expected)}
+                for user, (total, expected) in sorted(self.totals.items())
+            ],
+        }
+
+    def table(self):
+        rows = [(user, minutes(total), minutes(expected)) for user, (total, expected) in sorted(self.totals.items())]
+        return ["user", "work", "expected"], rows
+
+
+def computeTeam(con, offset=0):
+    """Compute the weekly work time of every user of the current project."""
+    period = Period.of("week", offset)
+    totals = {}
+    cur = con.execute(
+        """
+            SELECT user, COALESCE(SUM(work), 0)
+            FROM daily_summary WHERE project = ? AND day >= ? AND day < ? AND left_at IS NOT NULL
+            GROUP BY user
+        """,
+        (con.project, period.start, period.end),
+    )
+    for user, work in cur:
+        totals[user] = [timedelta(minutes=work), timedelta(0)]
+    openDays = con.execute(
+        "SELECT user, day FROM daily_summary WHERE project = ? AND day >= ? AND day < ? AND left_at IS NULL",
+        (con.project, period.start, period.end),
+    ).fetchall()
+    for user, openDay in openDays:
+        with con.timeline(user, con.project):
+            for record in iterWorkTime(con, openDay, openDay + timedelta(days=1)):
+                totals.setdefault(user, [timedelta(0), timedelta(0)])[0] += record.workTime
+    for user, total in totals.items():
+        with con.timeline(user, con.project):
+            total[1] = timedelta(minutes=expectedMinutes(con, period.start, period.end))
+    return TeamReport(con.project, period, totals)
+
+
+def textTeam(report):
+    """Render the work time of every user, along with the total of the whole team."""
+    project = f' "{report.project}"' if report.project else ""
+    lines = [f"Team statistics{project} for {report.period.title}:"]
+    lines.append("   user                  work    diff")
+    lines.append("   --------------------  ------- ------")
+    teamTotal = teamExtra = timedelta(0)
+    for user, (total, expected) in sorted(report.totals.items()):
+        totalHours = int(total.total_seconds() // (60 * 60))
+        totalMinutes = int((total.total_seconds() % 3600) // 60)
+        extraHours = (total - expected).total_seconds() / (60 * 60)
+        lines.append(f" * {user or '(default)':<20s} {totalHours:>3d}h{totalMinutes:>02d}m {extraHours:=+1.2f}")
+        teamTotal += total
+        teamExtra += total - expected
+    teamTotalHours = int(teamTotal.total_seconds() // (60 * 60))
+    teamTotalMinutes = int((teamTotal.total_seconds() % 3600) // 60)
+    lines.append("   --------------------  ------- ------")
+    teamExtraHours = teamExtra.total_seconds() / (60 * 60)
+    lines.append(f"   {'Team:':<20s} {teamTotalHours:>3d}h{teamTotalMinutes:>02d}m {teamExtraHours:=+1.2f}")
+    return lines
+
+
+def teamStatistics(con, offset=0, format="text"):
+    writeReport(computeTeam(con, offset), format)
+
+
+# Percentiles reported by the analyze action
+ANALYSIS_PERCENTILES = [10, 25, 50, 75, 90]
+
+WEEKDAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+
+class AnalysisReport:
+    """Statistics of all closed days of a timeline. Times of day are in minutes after
+    midnight of the day of the arrival, durations and balances in minutes. streaks
+    hold (length, first day, last day) of the longest runs of workdays worked and of
+    workdays with overtime."""
+
+    __slots__ = ("start", "end", "days", "percentiles", "histograms", "weekdays", "balance", "window", "streaks")
+
+    def __init__(self, start, end, days, percentiles, histograms, weekdays, balance, window, streaks):
+        self.start = start
+        self.end = end
+        self.days = days
+        self.percentiles = percentiles
+        self.histograms = histograms
+        self.weekdays = weekdays
+        self.balance = balance
+        self.window = window
+        self.streaks = streaks
+
+    def plain(self):
+        return {
+            "start": self.start.isoformat(),
+            "end": self.end.isoformat(),
+            "days": self.days,
+            "percentiles": {
+                name: dict(zip(map(str, ANALYSIS_PERCENTILES), values)) for name, values in self.percentiles.items()
+            },
+            "histograms": self.histograms,
+            "weekdays": [
+                {"weekday": WEEKDAY_NAMES[weekday], "days": days, "work": work, "break": breakTime}
+                for weekday, days, work, breakTime in self.weekdays
+            ],
+            "balance": {
+                "total": self.balance["total"],
+                "window": self.window,
+                "current": self.balance["current"],
+                "highest": self.balance["highest"][0],
+                "highest_until": self.balance["highest"][1].isoformat(),
+                "lowest": self.balance["lowest"][0],
+                "lowest_until": self.balance["lowest"][1].isoformat(),
+            },
+            "streaks": {
+                name: {"days": length, "first": first.isoformat(), "last": last.isoformat()} if length else None
+                for name, (length, first, last) in self.streaks.items()
+            },
+        }
+
+    def table(self):
+        columns = ["measure"] + [f"p{percentile}" for percentile in ANALYSIS_PERCENTILES]
+        return columns, [[name] + values for name, values in self.percentiles.items()]
+
+
+def longestRun(mask, days):
+    """Return the length, first and last day of the longest run of true values in
+    mask, whose elements are the given epoch days."""
+    import numpy as np
+
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    if not len(starts):
+        return 0, None, None
+    longest = int(np.argmax(ends - starts))
+    return int(ends[longest] - starts[longest]), days[starts[longest]], days[ends[longest] - 1]
+
+
+def computeAnalysis(con, window=28):
+    """Analyze the whole history of the timeline in one pass over column arrays. The
+    entries are loaded as epoch seconds of the local time and a type code, paired
+    into work and break intervals, and summed up per day of the arrival they follow.
+    Only closed days count, i.e. days with an arrival and a leave. The overtime
+    balance expects the minutes of the calendar on every day from the first to the
+    last closed day, like the summary does, and the rolling balance sums it up over
+    the last window days. Streaks only run over days the calendar expects work on."""
+    try:
+        import numpy as np
+    except ImportError as e:
+        error("The analyze action needs NumPy, install it with: pip install numpy", e)
+
+    rows = con.execute(
+        """
+            SELECT
+                CASE type WHEN ? THEN 0 WHEN ? THEN 1 WHEN ? THEN 2 WHEN ? THEN 3 END,
+                CASE WHEN typeof(ts) = 'integer' THEN ts / 1000000 ELSE CAST(strftime('%s', ts) AS INTEGER) END
+            FROM times WHERE user = ? AND project = ? ORDER BY ts ASC
+        """,
+        (ACT_ARRIVE, ACT_BREAK, ACT_RESUME, ACT_LEAVE, con.user, con.project),
+    ).fetchall()
+    entries = np.array(rows, dtype=np.int64).reshape(-1, 2)
+    types, ts = entries[:, 0], entries[:, 1]
+    arrive, leave = types == 0, types == 3
+    starting = arrive | (types == 2)
+    ending = (types == 1) | leave
+
+    # every entry belongs to the day of the last arrival before it
+    lastArrival = np.maximum.accumulate(np.where(arrive, np.arange(len(ts)), -1))
+    tracked = lastArrival >= 0
+    day = np.where(tracked, ts[lastArrival] // 86400, -1)
+    closedDays = np.unique(day[leave & tracked])
+    if not len(closedDays):
+        error("There are no closed days to analyze", None)
+
+    # intervals from one entry to the next, in the day of the entry they start at
+    durations = np.diff(ts)
+    intervalDay = day[:-1]
+    closed = np.isin(intervalDay, closedDays)
+    work = starting[:-1] & ending[1:] & closed
+    breaks = (types[:-1] == 1) & (types[1:] == 2) & closed
+    dayWork = np.bincount(
+        np.searchsorted(closedDays, intervalDay[work]), weights=durations[work], minlength=len(closedDays)
+    )
+    dayBreak = np.bincount(
+        np.searchsorted(closedDays, intervalDay[breaks]), weights=durations[breaks], minlength=len(closedDays)
+    )
+    dayWork, dayBreak = dayWork // 60, dayBreak // 60
+
+    # first arrival and last leave of every day, as minutes after its midnight
+    arrivalDays, first = np.unique(day[arrive], return_index=True)
+    arrivalTs = ts[arrive][first][np.isin(arrivalDays, closedDays)]
+    _, last = np.unique(day[leave & tracked][::-1], return_index=True)
+    leaveTs = ts[leave & tracked][::-1][last]
+    arrivedAt = (arrivalTs - closedDays * 86400) // 60
+    leftAt = (leaveTs - closedDays * 86400) // 60
+
+    percentiles = {}
+    for name, values in [("arrival", arrivedAt), ("leave", leftAt), ("work", dayWork), ("break", dayBreak)]:
+        percentiles[name] = [int(value) for value in np.percentile(values, ANALYSIS_PERCENTILES)]
+    histograms = {
+        name: [int(count) for count in np.bincount(values // 60 % 24, minlength=24)]
+        for name, values in [("arrival", arrivedAt), ("leave", leftAt)]
+    }
+
+    # 1970-01-01 was a Thursday
+    weekday = (closedDays + 3) % 7
+    counts = np.bincount(weekday, minlength=7)
+    workSums = np.bincount(weekday, weights=dayWork, minlength=7)
+    breakSums = np.bincount(weekday, weights=dayBreak, minlength=7)
+    weekdays = [
+        (i, int(counts[i]), int(workSums[i] // counts[i]), int(breakSums[i] // counts[i]))
+        for i in range(7)
+        if counts[i]
+    ]
+
+    # dense arrays over every calendar day from the first to the last closed day
+    origin = TS_EPOCH_ORIGIN.date().toordinal()
+    calendar = np.arange(closedDays[0], closedDays[-1] + 1)
+    rows = con.execute(
+        """
+            SELECT CAST(julianday(day) - 2440587.5 AS INTEGER), expected FROM calendar
+            WHERE user = ? AND project = ? AND day >= ? AND day <= ?
+        """,
+        (
+            con.user,
+            con.project,
+            date.fromordinal(origin + int(calendar[0])),
+            date.fromordinal(origin + int(calendar[-1])),
+        ),
+    ).fetchall()
+    expected = np.zeros(len(calendar), dtype=np.int64)
+    days = np.array(rows, dtype=np.int64).reshape(-1, 2)
+    expected[days[:, 0] - calendar[0]] = days[:, 1]
+    overtime = -expected
+    overtime[closedDays - calendar[0]] += dayWork.astype(np.int64)
+    window = max(1, min(window, len(calendar)))
+    balance = np.concatenate(([0], np.cumsum(overtime)))
+    rolling = balance[window:] - balance[:-window]
+    rollingEnd = calendar[window - 1 :]
+    highest, lowest = int(np.argmax(rolling)), int(np.argmin(rolling))
+
+    worked = np.zeros(len(calendar), dtype=bool)
+    worked[closedDays - calendar[0]] = True
+    workday = expected > 0
+    workdays = calendar[workday]
+    streaks = {}
+    for name, mask in [("worked", worked), ("overtime", worked & (overtime > 0))]:
+        length, firstDay, lastDay = longestRun(mask[workday], workdays)
+        if length:
+            firstDay, lastDay = date.fromordinal(origin + int(firstDay)), date.fromordinal(origin + int(lastDay))
+        streaks[name] = (length, firstDay, lastDay)
+
+    return AnalysisReport(
+        date.fromordinal(origin + int(closedDays[0])),
+        date.fromordinal(origin + int(closedDays[-1])),
+        len(closedDays),
+        percentiles,
+        histograms,
+        weekdays,
+        {
+            "total": int(balance[-1]),
+            "current": int(rolling[-1]),
+            "highest": (int(rolling[highest]), date.fromordinal(origin + int(rollingEnd[highest]))),
+            "lowest": (int(rolling[lowest]), date.fromordinal(origin + int(rollingEnd[lowest]))),
+        },
+        window,
+        streaks,
+    )
+
+
+def textAnalysis(report):
+    """Render the distributions as percentiles and hourly bars, followed by the
+    weekday averages, the overtime balance and the streaks."""
+
+    def clock(value):
+        return f"{value // 60:02d}:{value % 60:02d}"
+
+    def duration(value):
+        return f"{value // 60:d}h{value % 60:02d}m"
+
+    def hours(value):
+        return f"{value / 60:+.2f} h"
+
+    lines = [f"Analysis of {report.days} days worked from {report.start:%d.%m.%Y} to {report.end:%d.%m.%Y}:"]
+    lines.append("            " + "".join(f"{percentile:>8d}%" for percentile in ANALYSIS_PERCENTILES))
+    for name, render in [("arrival", clock), ("leave", clock), ("work", duration), ("break", duration)]:
+        lines.append(f"  {name.capitalize():<10s}" + "".join(f"{render(v):>9s}" for v in report.percentiles[name]))
+    for name, counts in report.histograms.items():
+        lines.append(f"{name.capitalize()}s by hour:")
+        scale = max(counts) / 50 or 1
+        for hour, count in enumerate(counts):
+            if count:
+                lines.append(f"  {hour:02d}  {'#' * max(1, round(count / scale)):<50s} {count:d}")
+    lines.append("Averages by weekday:")
+    lines.append("  weekday     days   work  break")
+    for weekday, days, work, breakTime in report.weekdays:
+        lines.append(f"  {WEEKDAY_NAMES[weekday]:<10s} {days:>5d} {duration(work):>6s} {duration(breakTime):>6s}")
+    balance = report.balance
+    lines.append(
+        f"Overtime: {hours(balance['total'])} in total, {hours(balance['current'])} in the last {report.window} days"
+    )
+    lines.append(
+        f"  {report.window} day balance between {hours(balance['lowest'][0])} until {balance['lowest'][1]:%d.%m.%Y}"
+        f" and {hours(balance['highest'][0])} until {balance['highest'][1]:%d.%m.%Y}"
+    )
+    for name, label in [("worked", "Longest streak of workdays worked"), ("overtime", "Longest streak of overtime")]:
+        length, first, last = report.streaks[name]
+        if length:
+            lines.append(f"{label}: {length} days from {first:%d.%m.%Y} to {last:%d.%m.%Y}")
+    return lines
+
+
+def analyzeStatistics(con, window=28, format="text"):
+    writeReport(computeAnalysis(con, window), format)
+
+
+class CalendarReport:
+    """The expected minutes and the kind of the days in [start, end). days holds
+    (day, expected, kind) of the days listed, by default those differing from the
+    default schedule."""
+
+    __slots__ = ("start", "end", "days", "expected", "workdays")
+
+    def __init__(self, start, end, days, expected, workdays):
+        self.start = start
+        self.end = end
+        self.days = days
+        self.expected = expected
+        self.workdays = workdays
+
+    def plain(self):
+        return {
+            "start": self.start.isoformat(),
+            "end": (self.end - timedelta(days=1)).isoformat(),
+            "expected": self.expected,
+            "workdays": self.workdays,
+            "days": [
+                {"day": day.isoformat(), "expected": expected, "kind": kind} for day, expected, kind in self.days
+            ],
+        }
+
+    def table(self):
+        return ["day", "expected", "kind"], [(day.isoformat(), expected, kind) for day, expected, kind in self.days]
+
+
+def defaultCalendarDay(day):
+    """Return the expected minutes and the kind of a day in the default schedule."""
+    if day.weekday() < 5:
+        return CALENDAR_KINDS["workday"], "workday"
+    return CALENDAR_KINDS["weekend"], "weekend"
+
+
+def computeCalendar(con, start=None, end=None, allDays=False):
+    """List the days from start until end (both inclusive, the current year by
+    default) that differ from the default schedule, or all of them."""
+    start = start or date(date.today().year, 1, 1)
+    end = (end or date(start.year, 12, 31)) + timedelta(days=1)
+    if end <= start:
+        error(f"The range ends before it starts on {start:%d.%m.%Y}", None)
+    calendar = calendarDays(con, start, end)
+    listed = [
+        (day, expected, kind)
+        for day, (expected, kind) in sorted(calendar.items())
+        if allDays or (expected, kind) != defaultCalendarDay(day)
+    ]
+    return CalendarReport(
+        start,
+        end,
+        listed,
+        sum(expected for expected, _ in calendar.values()),
+        sum(1 for expected, _ in calendar.values() if expected > 0),
+    )
+
+
+def textCalendar(report):
+    lines = [f"Calendar from {report.start:%d.%m.%Y} to {report.end - timedelta(days=1):%d.%m.%Y}:"]
+    for day, expected, kind in report.days:
+        lines.append(f"  {day:%a %d.%m.%Y}  {kind:<10s} {expected // 60:>2d} h {expected % 60:>02d} min")
+    lines.append(
+        f"Expected: {report.expected // 60:d} h {report.expected % 60:>02d} min on {report.workdays} workdays"
+    )
+    return lines
+
+
+def setCalendarDays(con, days):
+    """Set the expected minutes and the kind of the current timeline's days, given as
+    (day, expected, kind). Returns the number of days set."""
+    days = list(days)
+    if not days:
+        return 0
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        fillCalendar(con, min(day for day, _, _ in days).year, max(day for day, _, _ in days).year)
+        con.executemany(
+            "UPDATE calendar SET expected = ?, kind = ? WHERE user = ? AND project = ? AND day = ?",
+            ((expected, kind, con.user, con.project, day) for day, expected, kind in days),
+        )
+        updateLedger(con, min(day for day, _, _ in days))
+        # the expectations of cached reports changed
+        bumpDataVersion(con)
+        con.commit()
+    except sqlite3.Error as e:
+        con.rollback()
+        error("Updating the calendar failed", e)
+    return len(days)
+
+
+def expectedOf(kind, minutes=None):
+    """Return the minutes expected on a day of the given kind, or the given ones."""
+    if minutes is None:
+        minutes = CALENDAR_KINDS[kind]
+        if minutes is None:
+            error(f"Days of kind {kind} need their expected minutes", None)
+    if minutes < 0:
+        error(f"Expected minutes must not be negative, got {minutes}", None)
+    return minutes
+
+
+def parseWeekdays(value):
+    """Parse a comma separated list of weekdays, as numbers (0 is Monday) or names."""
+    weekdays = []
+    for item in value.split(","):
+        item = item.strip().lower()
+        if item.isdigit() and int(item) < 7:
+            weekdays.append(int(item))
+            continue
+        matches = [i for i, name in enumerate(WEEKDAY_NAMES) if len(item) >= 2 and name.lower().startswith(item)]
+        if len(matches) != 1:
+            raise ValueError(f"unknown weekday {item}")
+        weekdays.append(matches[0])
+    return weekdays
+
+
+def setCalendar(con, kind, start, end=None, minutes=None, weekdays=None):
+    """Set the kind and the expected minutes of the days from start until end, both
+    inclusive. Unless weekdays are given, ranges of more than one day skip weekends,
+    so a vacation can be entered as one range."""
+    expected = expectedOf(kind, minutes)
+    end = end or start
+    if end < start:
+        error(f"The range ends on {end:%d.%m.%Y}, before it starts on {start:%d.%m.%Y}", None)
+    if weekdays is None:
+        weekdays = range(7) if end == start or kind == "weekend" else range(5)
+    days = []
+    day = start
+    while day <= end:
+        if day.weekday() in weekdays:
+            days.append((day, expected, kind))
+        day += timedelta(days=1)
+    count = setCalendarDays(con, days)
+    message(f"Set {count} days to {kind} with {expected // 60:d} h {expected % 60:>02d} min expected")
+
+
+def parseIcalDays(lines):
+    """Yield the days of the events of an iCalendar file. Events run from their start
+    until the day before their end, which is exclusive. Recurrence rules are not
+    expanded, recurring events only yield their first occurrence."""
+    unfolded = []
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line[:1] in [" ", "\t"] and unfolded:
+            unfolded[-1] += line[1:]
+        else:
+            unfolded.append(line)
+
+    recurring = 0
+    start = end = None
+    for line in unfolded:
+        name, _, value = line.partition(":")
+        name = name.split(";")[0].upper()
+        if name == "BEGIN" and value.upper() == "VEVENT":
+            start = end = None
+        elif name == "DTSTART":
+            start = datetime.strptime(value[:8], "%Y%m%d").date()
+        elif name == "DTEND":
+            end = datetime.strptime(value[:8], "%Y%m%d").date()
+        elif name == "RRULE":
+            recurring += 1
+        elif name == "END" and value.upper() == "VEVENT" and start is not None:
+            day = start
+            while True:
+                yield day
+                day += timedelta(days=1)
+                if end is None or day >= end:
+                    break
+    if recurring:
+        warning(f"Only imported the first occurrence of {recurring} recurring events")
+
+
+def parseCalendarCsv(lines, kind):
+    """Yield (day, expected, kind) of "day[,kind[,minutes]]" CSV lines. The kind and
+    the minutes of a line default to the given kind and its expected minutes."""
+    import csv
+
+    for number, row in enumerate(csv.reader(lines), 1):
+        if not row or not row[0].strip():
+            continue
+        try:
+            day = date.fromisoformat(row[0].strip())
+        except ValueError as e:
+            if number == 1:
+                continue  # header line
+            error(f"Line {number} does not start with a day (YYYY-MM-DD)", e)
+        rowKind = row[1].strip() if len(row) > 1 and row[1].strip() else kind
+        if rowKind not in CALENDAR_KINDS:
+            error(f"Line {number} has the unknown kind {rowKind}", None)
+        try:
+            minutes = int(row[2]) if len(row) > 2 and row[2].strip() else None
+        except ValueError as e:
+            error(f"Line {number} has malformed minutes", e)
+        yield day, expectedOf(rowKind, minutes), rowKind
+
+
+def importCalendar(con, file="-", kind="holiday", format="auto"):
+    """Set the days of an iCalendar (.ics) or CSV list of holidays to the given kind,
+    or the kinds and minutes of the CSV lines. The whole list is set in a single
+    transaction."""
+    try:
+        if file == "-":
+            lines = sys.stdin.readlines()
+        else:
+            with open(file, encoding="utf-8", newline="") as f:
+                lines = f.readlines()
+    except OSError as e:
+        error(f"Cannot read {file}", e)
+    if format == "auto":
+        format = "ics" if any(line.strip().upper() == "BEGIN:VCALENDAR" for line in lines[:5]) else "csv"
+    if format == "ics":
+        try:
+            days = [(day, expectedOf(kind), kind) for day in parseIcalDays(lines)]
+        except ValueError as e:
+            error(f"Cannot parse the dates of {file}", e)
+    else:
+        days = list(parseCalendarCsv(lines, kind))
+    count = setCalendarDays(con, days)
+    message(f"Imported {count} days into the calendar")
+
+
+def showCalendar(con, start=None, end=None, allDays=False, format="text"):
+    writeReport(computeCalendar(con, start, end, allDays), format)
+
+
+# Actions of the calendar subcommand
+CALENDAR_ACTIONS = {
+    "show": showCalendar,
+    "set": setCalendar,
+    "import": importCalendar,
+}
+
+
+def runCalendarAction(con, calendarAction, **kwargs):
+    """Run the calendar action parsed into calendarAction with its arguments."""
+    CALENDAR_ACTIONS[calendarAction](con, **kwargs)
+
+
+TEXT_RENDERERS = {
+    DayReport: textDay,
+    PeriodReport: textPeriod,
+    SummaryReport: textSummary,
+    BalanceReport: textBalance,
+    TeamReport: textTeam,
+    AnalysisReport: textAnalysis,
+    CalendarReport: textCalendar,
+}
+
+
+def renderText(report):
+    return "".join(f"{line}\n" for line in TEXT_RENDERERS[type(report)](report))
+
+
+def renderJson(report):
+    import json
+
+    return json.dumps(report.plain()) + "\n"
+
+
+def renderCsv(report):
+    import csv
+    import io
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    columns, rows = report.table()
+    writer.writerow(columns)
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+# Output formats of the reports
+RENDERERS = {
+    "text": renderText,
+    "json": renderJson,
+    "csv": renderCsv,
+}
+
+
+def writeReport(report, format="text"):
+    """Render a report in the given format and write it to stdout in one go."""
+    sys.stdout.write(RENDERERS[format](report))
+
+
+def rollupWorker(path, start, end, user, project):
+    """Compute the work time per day of one database in [start, end) and the minutes
+    its calendar expects. Runs in a worker process, so it returns plain values: the
+    path, a list of (day, work minutes), the expected minutes and an error message,
+    if any."""
+    try:
+        con = dbOpenReadOnly(path, user, project)
+        try:
+            days = [
+                (record.day, int(record.workTime.total_seconds() // 60)) for record in iterWorkTime(con, start, end)
+            ]
+            expected = expectedMinutes(con, start, end)
+        finally:
+            con.close()
+    except ProgramAbortError as e:
+        return path, [], 0, e.message if e.cause is None else f"{e.message}: {e.cause}"
+    except sqlite3.Error as e:
+        return path, [], 0, str(e)
+    return path, days, expected, None
+
+
+def rollupStatistics(con, paths, period="week", offset=0, jobs=None, user="", project=""):
+    """Print the work time of many databases in a period, one per person, along with
+    the team total. The databases are read in parallel by a pool of processes."""
+    import glob
+    from concurrent.futures import ProcessPoolExecutor
+
+    files = []
+    for path in paths:
+        path = os.path.expanduser(path)
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*.db"))))
+        else:
+            files.extend(sorted(glob.glob(path)))
+    if not files:
+        error("No databases found in {}".format(", ".join(paths)), None)
+
+    period = Period.of(period, offset)
+    start, end = period.start, period.end
+    message(f"Rollup for {period.title}:")
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(rollupWorker, path, start, end, user, project) for path in files]
+        for future in futures:
+            path, days, expected, failure = future.result()
+            if failure is not None:
+                warning(f"Skipping {path}: {failure}")
+                continue
+            results[path] = days, expected
+
+    message("   person                days   work      diff")
+    message("   --------------------  ----  --------- -------")
+    teamMinutes = teamExpected = teamDays = 0
+    for path, (days, expected) in results.items():
+        # persons are named after their database files, or their directory for timetrack.db
+        name = os.path.splitext(os.path.basename(path))[0]
+        if name == "timetrack":
+            name = os.path.basename(os.path.dirname(os.path.abspath(path)))
+        minutes = sum(work for _, work in days)
+        diffHours = (minutes - expected) / 60
+        message(f" * {name:<20s}  {len(days):>4d}  {minutes // 60:>4d}h{minutes % 60:>02d}m {diffHours:+7.2f}")
+        teamMinutes += minutes
+        teamExpected += expected
+        teamDays += len(days)
+    message("   --------------------  ----  --------- -------")
+    teamDiffHours = (teamMinutes - teamExpected) / 60
+    message(
+        f"   {'Team:':<20s}  {teamDays:>4d}  {teamMinutes // 60:>4d}h{teamMinutes % 60:>02d}m {teamDiffHours:+7.2f}"
+    )
+
+
+def buildParser():
+    import argparse
+
     parser = argparse.ArgumentParser(description="Track your work time")
+    parser.add_argument(
+        "--busy-timeout",
+        type=int,
+        default=os.environ.get("TIMETRACK_BUSY_TIMEOUT", str(BUSY_TIMEOUT)),
+        metavar="MS",
+        help="Milliseconds to wait for the database if another process locked it (default: $TIMETRACK_BUSY_TIMEOUT)",
+    )
+    parser.add_argument(
+        "--db",
+        default=DB_PATH,
+        metavar="PATH",
+        help="Database file to use (default: $TIMETRACK_DB or ~/timetrack.db)",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        type=profileRows,
+        const=str(PROFILE_ROWS),
+        default=PROFILE,
+        metavar="N",
+        help=f"Profile the action and print its N most expensive functions to stderr, {PROFILE_ROWS} if N is 1 or"
+        " yes (default: $TIMETRACK_PROFILE)",
+    )
+    parser.add_argument(
+        "--trace-sql",
+        action="store_true",
+        default=TRACE_SQL,
+        help="Log every SQL statement with its wall time and row count to stderr (default: $TIMETRACK_TRACE_SQL)",
+    )
+    parser.add_argument(
+        "--startup-time",
+        action="store_true",
+        default=STARTUP_TIME,
+        help="Print how long each step of starting up and running the action took (default: $TIMETRACK_STARTUP_TIME)",
+    )
 
     commands = parser.add_subparsers(title="subcommands", dest="action", help="description", metavar="action")
     parser_morning = commands.add_parser("morning", help="Start a new day")
@@ -688,6 +3106,24 @@ def main():
         type=int,
         help="Offset in days to the current one to analyze. Note only negative values make sense here.",
     )
+    parser_day.add_argument(
+        "--watch", action="store_true", help="Keep the statistics on screen, updating them until interrupted"
+    )
+    parser_day.add_argument(
+        "--interval",
+        type=float,
+        default=1.0,
+        help="Seconds between checks for changes of the database while watching (default: 1)",
+    )
+    parser_status = commands.add_parser(
+        "status", help="Print whether you are working, on a break or gone, quickly enough for shell prompts"
+    )
+    parser_status.add_argument(
+        "--format",
+        default=STATUS_FORMAT,
+        help="Template of the line printed, with the fields {state}, {type}, {since}, {duration}, {duration_minutes},"
+        " {worked} and {worked_minutes} (default: $TIMETRACK_STATUS_FORMAT or %(default)r)",
+    )
     parser_week = commands.add_parser("week", help="Print weekly statistics")
     parser_week.add_argument(
         "offset",
@@ -704,6 +3140,33 @@ def main():
         type=int,
         help="Offset in months to the current one to analyze. Note only negative values make sense here.",
     )
+    parser_quarter = commands.add_parser("quarter", help="Print quarterly statistics")
+    parser_quarter.add_argument(
+        "offset",
+        nargs="?",
+        default=0,
+        type=int,
+        help="Offset in quarters to the current one to analyze. Note only negative values make sense here.",
+    )
+    parser_year = commands.add_parser("year", help="Print yearly statistics")
+    parser_year.add_argument(
+        "offset",
+        nargs="?",
+        default=0,
+        type=int,
+        help="Offset in years to the current one to analyze. Note only negative values make sense here.",
+    )
+    parser_report = commands.add_parser("report", help="Print statistics of a custom range of days")
+    parser_report.add_argument(
+        "--from", dest="start", type=date.fromisoformat, required=True, help="First day to include (YYYY-MM-DD)"
+    )
+    parser_report.add_argument(
+        "--to",
+        dest="end",
+        type=date.fromisoformat,
+        default=None,
+        help="Last day to include (YYYY-MM-DD), today by default",
+    )
     parser_summary = commands.add_parser("summary", help="Print overall statistics")
     parser_summary.add_argument(
         "weeks",
@@ -712,33 +3175,659 @@ def main():
         default=None,
         help="Number of weeks to include in summary",
     )
+    parser_balance = commands.add_parser("balance", help="Print the overtime balance of a range of days")
+    parser_balance.add_argument(
+        "--from",
+        dest="start",
+        type=date.fromisoformat,
+        default=None,
+        help="First day to include (YYYY-MM-DD), the first day with entries by default",
+    )
+    parser_balance.add_argument(
+        "--to",
+        dest="end",
+        type=date.fromisoformat,
+        default=None,
+        help="Last day to include (YYYY-MM-DD), today by default",
+    )
+    commands.add_parser("migrate", help="Upgrade the database schema to the latest version")
+    commands.add_parser("rebuild-summary", help="Recompute the stored per-day summaries from all entries")
+    parser_import = commands.add_parser("import", help="Bulk load entries from a CSV or JSON Lines file")
+    parser_import.add_argument(
+        "file",
+        nargs="?",
+        default="-",
+        help='File to read "type,ts" CSV or {"type": ..., "ts": ...} JSON lines from, stdin by default',
+    )
+    parser_import.add_argument(
+        "--format",
+        choices=["auto", "csv", "jsonl"],
+        default="auto",
+        help="Input format, detected from the first line by default",
+    )
+    parser_import.add_argument(
+        "--rejects",
+        default=None,
+        help="File to write rejected lines to, defaults to the input file name with .rejects appended",
+    )
+    parser_export = commands.add_parser("export", help="Write the entries or daily totals as CSV or JSON Lines")
+    parser_export.add_argument(
+        "what",
+        nargs="?",
+        choices=["entries", "days"],
+        default="entries",
+        help="Export the raw entries (default), or the work time per day",
+    )
+    parser_export.add_argument("--format", choices=["csv", "jsonl"], default="csv", help="Output format")
+    parser_export.add_argument("-o", "--output", default="-", help="File to write to, stdout by default")
+    parser_export.add_argument(
+        "--from", dest="start", type=date.fromisoformat, default=None, help="First day to export (YYYY-MM-DD)"
+    )
+    parser_export.add_argument(
+        "--to", dest="end", type=date.fromisoformat, default=None, help="Last day to export (YYYY-MM-DD)"
+    )
+    parser_timestamps = commands.add_parser("timestamps", help="Change how timestamps are stored in the database")
+    parser_timestamps.add_argument(
+        "format",
+        choices=[TS_ISO, TS_EPOCH],
+        help="ISO 8601 text, or compact integer microseconds since 1970-01-01",
+    )
+    parser_team = commands.add_parser("team", help="Print weekly statistics of all users")
+    parser_team.add_argument(
+        "offset",
+        nargs="?",
+        default=0,
+        type=int,
+        help="Offset in weeks to the current one to analyze. Note only negative values make sense here.",
+    )
+    parser_analyze = commands.add_parser(
+        "analyze", help="Print distributions, averages, balances and streaks of the whole history (needs NumPy)"
+    )
+    parser_analyze.add_argument(
+        "--window", type=int, default=28, help="Days to sum up the rolling overtime balance over (default: 28)"
+    )
+    parser_calendar = commands.add_parser("calendar", help="Show or change the work time expected on every day")
+    calendarCommands = parser_calendar.add_subparsers(
+        title="calendar actions", dest="calendarAction", metavar="calendar action", required=True
+    )
+    parser_calendar_show = calendarCommands.add_parser(
+        "show", help="List the days differing from the default schedule, e.g. holidays and vacations"
+    )
+    parser_calendar_show.add_argument(
+        "--from", dest="start", type=date.fromisoformat, default=None, help="First day to list, January 1st by default"
+    )
+    parser_calendar_show.add_argument(
+        "--to", dest="end", type=date.fromisoformat, default=None, help="Last day to list, December 31st by default"
+    )
+    parser_calendar_show.add_argument("--all", dest="allDays", action="store_true", help="List every day")
+    parser_calendar_show.add_argument(
+        "--format", choices=list(RENDERERS), default="text", help="Output format, text by default"
+    )
+    parser_calendar_set = calendarCommands.add_parser("set", help="Set the kind and the expected work time of days")
+    parser_calendar_set.add_argument("kind", choices=list(CALENDAR_KINDS), help="Kind of the days")
+    parser_calendar_set.add_argument(
+        "--from", dest="start", type=date.fromisoformat, required=True, help="First day to set (YYYY-MM-DD)"
+    )
+    parser_calendar_set.add_argument(
+        "--to", dest="end", type=date.fromisoformat, default=None, help="Last day to set, only the first by default"
+    )
+    parser_calendar_set.add_argument(
+        "--minutes", type=int, default=None, help="Minutes expected on each day, by default those of the kind"
+    )
+    parser_calendar_set.add_argument(
+        "--weekdays",
+        type=parseWeekdays,
+        default=None,
+        help="Comma separated weekdays to set, e.g. mon,tue or 0,1 (default: Monday to Friday for ranges)",
+    )
+    parser_calendar_import = calendarCommands.add_parser(
+        "import", help='Set the days of an iCalendar or CSV ("day,kind,minutes") holiday list'
+    )
+    parser_calendar_import.add_argument("file", nargs="?", default="-", help="File to read, stdin by default")
+    parser_calendar_import.add_argument(
+        "--kind", choices=list(CALENDAR_KINDS), default="holiday", help="Kind of the days listed, holiday by default"
+    )
+    parser_calendar_import.add_argument(
+        "--format",
+        choices=["auto", "ics", "csv"],
+        default="auto",
+        help="Input format, detected from the first lines by default",
+    )
+    parser_rollup = commands.add_parser("rollup", help="Print statistics of many databases")
+    parser_rollup.add_argument(
+        "paths", nargs="+", metavar="path", help="Database file, glob or directory containing *.db files"
+    )
+    parser_rollup.add_argument(
+        "--period", choices=PERIODS, default="week", help="Period to sum up, the current week by default"
+    )
+    parser_rollup.add_argument(
+        "--offset",
+        default=0,
+        type=int,
+        help="Offset in periods to the current one to analyze. Note only negative values make sense here.",
+    )
+    parser_rollup.add_argument(
+        "--jobs", type=int, default=None, help="Number of worker processes (default: number of CPUs)"
+    )
+    parser_serve = commands.add_parser("serve", help="Answer punches and reports of other invocations as a daemon")
+    parser_serve.add_argument(
+        "--socket",
+        dest="socketPath",
+        default=SOCKET_PATH,
+        help="Unix domain socket to listen on (default: $TIMETRACK_SOCKET or ~/.timetrack.sock)",
+    )
+    parser_api = commands.add_parser("api", help="Serve punches and reports as JSON over HTTP")
+    parser_api.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser_api.add_argument("--port", type=int, default=8765, help="Port to listen on (default: 8765)")
+    parser_api.add_argument(
+        "--workers", type=int, default=4, help="Number of threads running reports, each with its own connection"
+    )
+    for action, subparser in commands.choices.items():
+        # maintenance actions work on the whole database
+        if action in ["migrate", "rebuild-summary", "timestamps", "serve"]:
+            continue
+        # the calendar takes them after its own actions
+        for target in calendarCommands.choices.values() if action == "calendar" else [subparser]:
+            if action != "team":
+                target.add_argument(
+                    "--user",
+                    default=os.environ.get("TIMETRACK_USER", ""),
+                    help="User to record or report the entries of (default: $TIMETRACK_USER)",
+                )
+            target.add_argument(
+                "--project",
+                default=os.environ.get("TIMETRACK_PROJECT", ""),
+                help="Project to record or report the entries of (default: $TIMETRACK_PROJECT)",
+            )
+    for action in ["day", "week", "month", "quarter", "year", "report", "summary", "balance", "team", "analyze"]:
+        commands.choices[action].add_argument(
+            "--format", choices=list(RENDERERS), default="text", help="Output format, text by default"
+        )
 
-    args = parser.parse_args()
+    return parser
 
-    actions: dict[str, tuple[Callable, list[str]]] = {
-        "morning": (startTracking, ["offset"]),
-        "break": (suspendTracking, ["offset"]),
-        "resume": (resumeTracking, ["offset"]),
-        "continue": (resumeTracking, ["offset"]),
-        "closing": (endTracking, ["offset"]),
-        "day": (dayStatistics, ["offset"]),
-        "week": (weekStatistics, ["offset"]),
-        "month": (monthStatistics, ["offset"]),
-        "summary": (overallStatistics, ["weeks"]),
-    }
 
-    if args.action not in actions:
+def runAction(con, args):
+    """Run the handler of the action parsed into args on the connection con."""
+    extraArgs = {}
+    handler, extraArgNames = ACTIONS[args.action]
+    for extraArgName in extraArgNames:
+        if hasattr(args, extraArgName):
+            extraArgs[extraArgName] = getattr(args, extraArgName)
+    if args.profile:
+        import cProfile
+        import pstats
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(handler, con, **extraArgs)
+        finally:
+            stats = pstats.Stats(profiler, stream=sys.stderr)
+            stats.sort_stats(pstats.SortKey.TIME).print_stats(args.profile)
+    else:
+        handler(con, **extraArgs)
+
+
+def timetrackEnviron():
+    """Return the TIMETRACK_* environment variables, which the defaults of the command
+    line arguments depend on."""
+    return {key: value for key, value in os.environ.items() if key.startswith("TIMETRACK_")}
+
+
+class Daemon:
+    """Runs the actions of clients on one long lived connection, one at a time. Each
+    client sends a JSON line with its command line arguments, working directory and
+    TIMETRACK_* environment. The reply is a JSON line with the exit status and output
+    of the action, or asks the client to run the action itself."""
+
+    def __init__(self, con, listener):
+        self.con = con
+        self.listener = listener
+        self.parser = buildParser()
+        self.database = os.path.realpath(con.execute("PRAGMA database_list").fetchone()["file"])
+        self.environ = timetrackEnviron()
+
+    def serveForever(self):
+        while True:
+            client, _ = self.listener.accept()
+            # one stalled client must not keep all the others waiting
+            client.settimeout(DAEMON_REQUEST_TIMEOUT)
+            with client, client.makefile("rwb") as stream:
+                self.handle(stream)
+
+    def handle(self, stream):
+        import json
+
+        try:
+            request = json.loads(stream.readline())
+        except (OSError, ValueError):
+            # timed out or incomplete, so nothing has run
+            return
+        try:
+            stream.write(json.dumps(self.answer(request)).encode("utf-8") + b"\n")
+            stream.flush()
+        except OSError:
+            pass  # the client is gone, nothing to tell it anymore
+
+    def answer(self, request):
+        import io
+        import traceback
+        from contextlib import redirect_stderr, redirect_stdout
+
+        if request.get("environ") != self.environ:
+            # the defaults of the client's arguments differ from ours
+            return {"fallback": True}
+        out, err = io.StringIO(), io.StringIO()
+        with redirect_stdout(out), redirect_stderr(err):
+            try:
+                args = self.parser.parse_args(request["argv"])
+            except SystemExit as e:
+                # usage errors and --help
+                return {"status": e.code or 0, "stdout": out.getvalue(), "stderr": err.getvalue()}
+            database = os.path.realpath(os.path.join(request["cwd"], os.path.expanduser(args.db)))
+            diagnostics = args.profile or args.trace_sql or args.startup_time
+            # watching never ends, so it would keep all other clients waiting
+            watching = getattr(args, "watch", False)
+            if args.action not in DAEMON_ACTIONS or diagnostics or watching or database != self.database:
+                return {"fallback": True}
+            status = 0
+            try:
+                with self.con.timeline(getattr(args, "user", ""), getattr(args, "project", "")):
+                    runAction(self.con, args)
+            except ProgramAbortError as e:
+                print(str(e), file=sys.stderr)
+                status = 1
+            except Exception:
+                # keep serving, but don't leave a half done transaction behind
+                if self.con.in_transaction:
+                    self.con.rollback()
+                traceback.print_exc()
+                status = 1
+        return {"status": status, "stdout": out.getvalue(), "stderr": err.getvalue()}
+
+
+def serve(con, socketPath=SOCKET_PATH):
+    """Answer the punches and reports of other invocations on a Unix domain socket,
+    keeping the connection, its cache of pages and the memoized state and daily
+    summaries across requests."""
+    import signal
+    import socket
+
+    path = os.path.expanduser(socketPath)
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX)
+        try:
+            probe.connect(path)
+        except ConnectionRefusedError:
+            os.unlink(path)  # left behind by a daemon that died
+        else:
+            error(f"Another daemon is already listening on {path}", None)
+        finally:
+            probe.close()
+    con.memo = {}
+    listener = socket.socket(socket.AF_UNIX)
+    # only the user running the daemon may connect to it
+    umask = os.umask(0o177)
+    try:
+        listener.bind(path)
+        listener.listen(64)
+    except OSError as e:
+        listener.close()
+        error(f"Cannot listen on {path}", e)
+    finally:
+        os.umask(umask)
+    daemon = Daemon(con, listener)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    message(f"Serving {daemon.database} on {path}")
+    try:
+        with listener:
+            daemon.serveForever()
+    finally:
+        os.unlink(path)
+
+
+def forwardToDaemon(argv, socketPath=SOCKET_PATH):
+    """Run the action of the command line arguments argv in a running daemon. Returns
+    its exit status after printing its output, or None if no daemon is running or it
+    leaves the action to this process."""
+    path = os.path.expanduser(socketPath)
+    if not os.path.exists(path):
+        return None
+    import json
+    import socket
+
+    request = {"argv": argv, "cwd": os.getcwd(), "environ": timetrackEnviron()}
+    with socket.socket(socket.AF_UNIX) as client:
+        client.settimeout(DAEMON_REQUEST_TIMEOUT)
+        try:
+            client.connect(path)
+            client.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        except OSError:
+            # the daemon never runs an incomplete request, so it is ours to run
+            return None
+        client.settimeout(DAEMON_REPLY_TIMEOUT)
+        try:
+            reply = json.loads(client.makefile("rb").readline())
+        except (OSError, ValueError) as e:
+            # the action may have run already, so running it again is no option
+            print(str(ProgramAbortError(f"Lost the connection to the daemon on {path}", e)), file=sys.stderr)
+            return 1
+    if reply.get("fallback"):
+        return None
+    sys.stdout.write(reply["stdout"])
+    sys.stderr.write(reply["stderr"])
+    return reply["status"]
+
+
+class PunchResult:
+    """An entry recorded by a punch, and the time of the entry before it."""
+
+    __slots__ = ("type", "ts", "previous")
+
+    def __init__(self, type, ts, previous):
+        self.type = type
+        self.ts = ts
+        self.previous = previous
+
+    def plain(self):
+        return {
+            "type": self.type,
+            "ts": adapt_datetime_iso(self.ts),
+            # the first entry of a timeline has none before it
+            "previous": adapt_datetime_iso(self.previous) if self.previous is not None else None,
+        }
+
+
+def apiPunch(con, type, offset=0):
+    ts, lastTime = punch(con, type, offset)
+    return PunchResult(type, ts, lastTime)
+
+
+# Punch actions the API accepts by POST, and the type of entry they record
+API_PUNCHES = {
+    "morning": ACT_ARRIVE,
+    "break": ACT_BREAK,
+    "resume": ACT_RESUME,
+    "continue": ACT_RESUME,
+    "closing": ACT_LEAVE,
+}
+
+
+class ApiServer:
+    """Serves punches and reports as JSON over HTTP. Requests are parsed on the asyncio
+    event loop, reports run on a bounded pool of threads with one read-only
+    connection each, and punches on a single thread with the only connection that
+    writes, so they are serialized."""
+
+    def __init__(self, path, busyTimeout, user, project, workers):
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.path = path
+        self.busyTimeout = busyTimeout
+        self.user = user
+        self.project = project
+        self.local = threading.local()
+        self.readers = ThreadPoolExecutor(workers, "api-reader", initializer=self.connect, initargs=(True,))
+        self.writer = ThreadPoolExecutor(1, "api-writer", initializer=self.connect, initargs=(False,))
+
+    def connect(self, readOnly):
+        if readOnly:
+            self.local.con = dbOpenReadOnly(self.path)
+        else:
+            self.local.con = dbSetup(upgrade=False, busyTimeout=self.busyTimeout, path=self.path)
+
+    def call(self, user, project, function, *args):
+        """Run function on the connection of the current worker thread, returning the
+        plain data of its result."""
+        con = self.local.con
+        with con.timeline(user, project):
+            return function(con, *args).plain()
+
+    async def respond(self, method, target):
+        """Return the HTTP status and the JSON serializable payload for a request."""
+        import asyncio
+        import traceback
+        import urllib.parse
+        from http import HTTPStatus
+
+        url = urllib.parse.urlsplit(target)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        name = url.path.strip("/")
+        timeline = query.get("user", self.user), query.get("project", self.project)
+        loop = asyncio.get_running_loop()
+        try:
+            offset = int(query.get("offset", 0))
+            if name in API_PUNCHES:
+                if method != "POST":
+                    return HTTPStatus.METHOD_NOT_ALLOWED, {"error": f"Use POST to {name}"}
+                call = self.writer, apiPunch, API_PUNCHES[name], offset
+            elif method != "GET":
+                return HTTPStatus.METHOD_NOT_ALLOWED, {"error": f"Use GET to read {name}"}
+            elif name == "day":
+                call = self.readers, computeDay, offset
+            elif name in PERIODS:
+                call = self.readers, computePeriod, Period.of(name, offset)
+            elif name == "summary":
+                call = self.readers, computeSummary, int(query["weeks"]) if "weeks" in query else None
+            elif name == "balance":
+                start, end = (date.fromisoformat(query[key]) if key in query else None for key in ["from", "to"])
+                call = self.readers, computeBalance, start, end
+            elif name == "team":
+                call = self.readers, computeTeam, offset
+            else:
+                return HTTPStatus.NOT_FOUND, {"error": f"Unknown resource {url.path}"}
+            executor, function, *args = call
+            return HTTPStatus.OK, await loop.run_in_executor(executor, self.call, *timeline, function, *args)
+        except (ValueError, OverflowError) as e:
+            # malformed parameters, or offsets beyond the dates and times there are
+            return HTTPStatus.BAD_REQUEST, {"error": str(e)}
+        except ProgramAbortError as e:
+            # punches that don't follow the current state
+            return HTTPStatus.CONFLICT, {"error": e.message}
+        except sqlite3.Error as e:
+            return HTTPStatus.SERVICE_UNAVAILABLE, {"error": str(e)}
+        except Exception as e:
+            # keep serving, and don't leave the client without an answer
+            traceback.print_exc()
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {"error": f"Internal error: {e}"}
+
+    async def serveClient(self, reader, writer):
+        """Answer the requests of one HTTP/1.1 client until it closes the connection."""
+        import asyncio
+        import json
+
+        try:
+            while requestLine := await reader.readline():
+                method, target, version = requestLine.decode("latin-1").split()
+                headers = {}
+                while (line := await reader.readline()).strip():
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                # no request has a body, but keep the stream in sync
+                await reader.readexactly(int(headers.get("content-length", 0)))
+                status, payload = await self.respond(method, target)
+                body = json.dumps(payload).encode("utf-8")
+                keepAlive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                writer.write(
+                    f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    f"Connection: {'keep-alive' if keepAlive else 'close'}\r\n\r\n".encode("latin-1") + body
+                )
+                await writer.drain()
+                if not keepAlive:
+                    break
+        except (ValueError, ConnectionError, asyncio.IncompleteReadError):
+            pass  # malformed request or client gone, just hang up
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        import asyncio
+
+        server = await asyncio.start_server(self.serveClient, host, port, backlog=1024)
+        with self.readers, self.writer:
+            async with server:
+                message(f"Serving {self.path} on http://{host}:{port}/")
+                await server.serve_forever()
+
+
+def api(con, host="127.0.0.1", port=8765, workers=4):
+    """Serve punches and reports as JSON over HTTP until interrupted. Punch by POST to
+    /morning, /break, /resume or /closing; read /day, /week, /month, /quarter, /year
+    /summary, /balance or /team by GET. All accept the offset, user and project as query parameters,
+    /balance takes the days from and to instead of an offset."""
+    import asyncio
+
+    path = con.execute("PRAGMA database_list").fetchone()["file"]
+    busyTimeout = con.execute("PRAGMA busy_timeout").fetchone()[0]
+    server = ApiServer(path, busyTimeout, con.user, con.project, workers)
+    con.close()
+    try:
+        asyncio.run(server.serve(host, port))
+    except OSError as e:
+        error(f"Cannot listen on {host}:{port}", e)
+
+
+ACTIONS: dict[str, tuple[Callable, list[str]]] = {
+    "morning": (startTracking, ["offset"]),
+    "break": (suspendTracking, ["offset"]),
+    "resume": (resumeTracking, ["offset"]),
+    "continue": (resumeTracking, ["offset"]),
+    "closing": (endTracking, ["offset"]),
+    "day": (dayStatistics, ["offset", "format", "watch", "interval"]),
+    "status": (showStatus, ["db", "user", "project", "format", "busy_timeout"]),
+    "week": (weekStatistics, ["offset", "format"]),
+    "month": (monthStatistics, ["offset", "format"]),
+    "quarter": (quarterStatistics, ["offset", "format"]),
+    "year": (yearStatistics, ["offset", "format"]),
+    "report": (rangeStatistics, ["start", "end", "format"]),
+    "summary": (overallStatistics, ["weeks", "format"]),
+    "balance": (balanceStatistics, ["start", "end", "format"]),
+    "migrate": (migrateDatabase, []),
+    "timestamps": (convertTimestamps, ["format"]),
+    "import": (importEntries, ["file", "format", "rejects"]),
+    "export": (exportData, ["what", "format", "output", "start", "end"]),
+    "rebuild-summary": (rebuildSummary, []),
+    "team": (teamStatistics, ["offset", "format"]),
+    "analyze": (analyzeStatistics, ["window", "format"]),
+    "calendar": (
+        runCalendarAction,
+        ["calendarAction", "kind", "start", "end", "minutes", "weekdays", "allDays", "file", "format"],
+    ),
+    "rollup": (rollupStatistics, ["paths", "period", "offset", "jobs", "user", "project"]),
+    "serve": (serve, ["socketPath"]),
+    "api": (api, ["host", "port", "workers"]),
+}
+
+
+PUNCH_ACTIONS = ["morning", "break", "resume", "continue", "closing"]
+
+
+def profileRows(value):
+    """Parse the number of functions --profile prints: a count, with 1 or a flag like
+    "yes" meaning PROFILE_ROWS and 0 or a flag like "no" meaning no profile."""
+    value = value.strip().lower()
+    if value in FALSE_FLAGS:
+        return 0
+    if value in ["1", "yes", "true", "on"]:
+        return PROFILE_ROWS
+    if not value.isdigit():
+        raise ValueError(f"expected a number of functions, yes or no, got {value!r}")
+    return int(value)
+
+
+class PunchArgs:
+    """The arguments of a punch or status, recognized without building the argument
+    parser."""
+
+    def __init__(self, action):
+        self.action = action
+        self.offset = 0
+        self.format = STATUS_FORMAT
+        self.user = os.environ.get("TIMETRACK_USER", "")
+        self.project = os.environ.get("TIMETRACK_PROJECT", "")
+        self.db = DB_PATH
+        # malformed values raise ValueError, leaving them to the full argument parser
+        self.busy_timeout = int(os.environ.get("TIMETRACK_BUSY_TIMEOUT", BUSY_TIMEOUT))
+        self.profile = profileRows(PROFILE)
+        self.trace_sql = TRACE_SQL
+        self.startup_time = STARTUP_TIME
+
+
+def parsePunchArgs(argv):
+    """Recognize the command line of a plain punch like "closing 5 --user me" from
+    argv, which is by far the most common one, or of a status like "status --format
+    {state}", which prompts run all the time. Returns a PunchArgs, or None for
+    anything else, which is left to the full argument parser."""
+    if argv[:1] == ["--startup-time"]:
+        args = parsePunchArgs(argv[1:])
+        if args is not None:
+            args.startup_time = True
+        return args
+    if not argv or argv[0] not in PUNCH_ACTIONS + ["status"]:
+        return None
+    try:
+        args = PunchArgs(argv[0])
+    except ValueError:
+        return None
+    rest = argv[1:]
+    options = ["--user", "--project"]
+    if args.action == "status":
+        options.append("--format")
+    elif rest and rest[0].lstrip("-").isdigit():
+        args.offset = int(rest.pop(0))
+    while rest:
+        option, _, value = rest.pop(0).partition("=")
+        if option not in options:
+            return None
+        if not value:
+            if not rest:
+                return None
+            value = rest.pop(0)
+        setattr(args, option[2:], value)
+    return args
+
+
+def main():
+    # CPU time of starting the interpreter and importing this module
+    loaded = process_time()
+    steps = [("start", perf_counter())]
+
+    args = parsePunchArgs(sys.argv[1:])
+    # Let a running daemon answer, it has everything set up already. A status is read
+    # from its snapshot faster than the daemon could be asked.
+    if args is None or args.action != "status":
+        status = forwardToDaemon(sys.argv[1:])
+        if status is not None:
+            sys.exit(status)
+        steps.append(("daemon", perf_counter()))
+
+    if args is None:
+        args = buildParser().parse_args()
+        steps.append(("arguments", perf_counter()))
+    else:
+        steps.append(("fast arguments", perf_counter()))
+
+    if args.action not in ACTIONS:
         message(f'Unsupported action "{args.action}". Use --help to get usage information.')
         sys.exit(1)
 
+    connection = None
     try:
-        connection = dbSetup()
-        extraArgs = {}
-        handler, extraArgNames = actions[args.action]
-        for extraArgName in extraArgNames:
-            if extraArgName in args:
-                extraArgs[extraArgName] = getattr(args, extraArgName)
-        handler(connection, **extraArgs)
+        # let the migrate action apply and report the upgrades itself
+        if args.action not in ["rollup", "status"]:  # read their own databases
+            connection = dbSetup(
+                upgrade=args.action != "migrate",
+                busyTimeout=args.busy_timeout,
+                path=args.db,
+                user=getattr(args, "user", ""),
+                project=getattr(args, "project", ""),
+                traceSql=args.trace_sql,
+            )
+            steps.append(("database", perf_counter()))
+        runAction(connection, args)
         sys.exit(0)
     except ProgramAbortError as e:
         print(str(e), file=sys.stderr)
@@ -746,6 +3835,19 @@ def main():
     except KeyboardInterrupt as e:
         print()
         sys.exit(255)
+    finally:
+        if connection is not None and connection.tracer is not None:
+            connection.tracer.close()
+        if args.startup_time:
+            steps.append(("action", perf_counter()))
+            timings = ", ".join(
+                f"{name} {(end - start) * 1000:.1f} ms" for (_, start), (name, end) in zip(steps, steps[1:])
+            )
+            print(
+                f"Startup: interpreter and imports {loaded * 1000:.1f} ms CPU, {timings},"
+                f" total {(steps[-1][1] - steps[0][1] + loaded) * 1000:.1f} ms",
+                file=sys.stderr,
+            )
 
 
 if __name__ == "__main__":